@@ -0,0 +1,420 @@
+import threading
+import time
+from datetime import date, timedelta
+from flask import current_app
+from sqlalchemy import event, func
+from database import db, SiteSession, settled_until, changed_between
+from models import BloodUnitInfoModel, DonorModel
+from sites import current_site, run_in_background
+
+#numpy is imported by enable_analytics so batch jobs that don't use the engine skip it
+np = None
+
+#----------------------------------columnar inventory engine-----------------------------------#
+#optional in-memory copy of bloodunit_info and donors kept as numpy columns.
+#statuses and blood types are stored as small integer codes and dates as day ordinals,
+#so the analytics in functions.py become vectorized scans instead of sql round trips.
+#enable with ANALYTICS_ENGINE=1 (needs numpy), every committed write is applied as a delta.
+#writes from other processes (workers, cli.py, manual sql) are picked up by sync(), which
+#runs in the background and reads the rows whose updated_at moved since the last sync.
+#rows deleted elsewhere are caught by comparing a count and a sum of the ids with the
+#database, and the engine is reloaded from scratch every ANALYTICS_RELOAD_SECONDS
+
+BLOOD_TYPES = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
+UNIT_STATUSES = ["Available", "Reserved", "Issued", "Transfused", "Expired", "Discarded"]
+
+#codes for values outside the lists above
+NO_CODE = -1         #NULL in the database
+OTHER_CODE = -2      #a value not in the list
+DELETED_CODE = -3    #row was deleted (tombstone)
+NO_DATE = -1
+
+#a sync only reads up to this far behind the database clock, see database.settled_until
+SYNC_SETTLE = timedelta(seconds=2)
+
+_TYPE_CODES = {bt: i for i, bt in enumerate(BLOOD_TYPES)}
+_STATUS_CODES = {status: i for i, status in enumerate(UNIT_STATUSES)}
+AVAILABLE = _STATUS_CODES["Available"]
+EXPIRED = _STATUS_CODES["Expired"]
+
+
+def _code(value, codes):
+    if value is None:
+        return NO_CODE
+    return codes.get(value, OTHER_CODE)
+
+
+def _ordinal(value):
+    if value is None:
+        return NO_DATE
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return value.toordinal()
+
+
+#growable set of equally sized numpy columns with an id -> row index
+class _Columns:
+    def __init__(self, dtypes, capacity=1024):
+        self.dtypes = dtypes
+        self.size = 0
+        self.rows = {}
+        self.data = {name: np.empty(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def load(self, ids, columns):
+        self.size = len(ids)
+        capacity = max(1024, self.size * 2)
+        self.rows = {row_id: i for i, row_id in enumerate(ids)}
+        for name, dtype in self.dtypes.items():
+            self.data[name] = np.empty(capacity, dtype=dtype)
+            self.data[name][:self.size] = columns[name]
+
+    #inserts or updates one row, returns its index
+    def upsert(self, row_id, values):
+        i = self.rows.get(row_id)
+        if i is None:
+            if self.size == len(self.data["id"]):
+                for name, column in self.data.items():
+                    grown = np.empty(len(column) * 2, dtype=column.dtype)
+                    grown[:self.size] = column[:self.size]
+                    self.data[name] = grown
+            i = self.size
+            self.size += 1
+            self.rows[row_id] = i
+            self.data["id"][i] = row_id
+        for name, value in values.items():
+            self.data[name][i] = value
+        return i
+
+    def remove(self, row_id):
+        return self.rows.pop(row_id, None)
+
+    def __getitem__(self, name):
+        return self.data[name][:self.size]
+
+
+class InventoryEngine:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.watermark = None
+        self.max_ids = {"units": None, "donors": None}
+        self.synced = None
+        self.loaded = None
+        self.units = _Columns({
+            "id": np.int64, "donor": np.int64, "expiry": np.int32,
+            "status": np.int8, "blood_type": np.int8
+        })
+        self.donors = _Columns({
+            "id": np.int64, "blood_type": np.int8, "last_donated": np.int32
+        })
+
+    #reads both tables once with plain column queries (no orm objects)
+    def load(self, session):
+        until = settled_until(session, BloodUnitInfoModel, SYNC_SETTLE)
+        max_ids = self._max_ids(session)
+        donor_rows = self._donor_rows(session).all()
+        unit_rows = self._unit_rows(session).all()
+
+        with self._lock:
+            self.donors.load([r[0] for r in donor_rows], {
+                "id": [r[0] for r in donor_rows],
+                "blood_type": [_code(r[1], _TYPE_CODES) for r in donor_rows],
+                "last_donated": [_ordinal(r[2]) for r in donor_rows]
+            })
+            self.units.load([r[0] for r in unit_rows], {
+                "id": [r[0] for r in unit_rows],
+                "donor": [NO_CODE if r[1] is None else r[1] for r in unit_rows],
+                "expiry": [_ordinal(r[2]) for r in unit_rows],
+                "status": [_code(r[3], _STATUS_CODES) for r in unit_rows],
+                "blood_type": NO_CODE
+            })
+            self._link_blood_types()
+        self.max_ids = max_ids
+        self.watermark = until
+        self.synced = self.loaded = time.monotonic()
+        return self
+
+    def _donor_rows(self, session):
+        return session.query(DonorModel.donor_id, DonorModel.blood_type, DonorModel.last_donated_date)
+
+    def _unit_rows(self, session):
+        return session.query(
+            BloodUnitInfoModel.unit_id, BloodUnitInfoModel.donor_id,
+            BloodUnitInfoModel.expiry_date, BloodUnitInfoModel.unit_status
+        )
+
+    #units carry their donor's blood type so inventory scans need no join.
+    #matches every unit to its donor at once (sorted donor ids + searchsorted)
+    def _link_blood_types(self):
+        donors = self.units["donor"]
+        if self.donors.size == 0:
+            self.units["blood_type"][:] = NO_CODE
+            return
+        order = np.argsort(self.donors["id"])
+        ids = self.donors["id"][order]
+        codes = self.donors["blood_type"][order]
+        i = np.minimum(np.searchsorted(ids, donors), len(ids) - 1)
+        #deleted donors have id NO_CODE, units without a donor never match them
+        found = (donors != NO_CODE) & (ids[i] == donors)
+        self.units["blood_type"][:] = np.where(found, codes[i], NO_CODE)
+
+    #------------------------------resync------------------------------#
+    #marks the engine as syncing, only the first caller of each interval gets True
+    def claim_sync(self, interval):
+        with self._lock:
+            if self.synced is not None and time.monotonic() - self.synced < interval:
+                return False
+            self.synced = time.monotonic()
+            return True
+
+    #applies the rows changed by any process since the last sync, then reloads everything
+    #if rows were deleted elsewhere or the last full load is older than reload_after seconds
+    def sync(self, session, reload_after=None):
+        if not self._sync_lock.acquire(blocking=False):
+            return None  #another thread is already syncing
+        try:
+            if self.watermark is None or (reload_after and time.monotonic() - self.loaded >= reload_after):
+                self.load(session)
+                return {"donors": self.donors.size, "units": self.units.size, "reloaded": True}
+
+            until = settled_until(session, BloodUnitInfoModel, SYNC_SETTLE)
+            max_ids = self._max_ids(session)
+            donors = changed_between(
+                self._donor_rows(session), DonorModel.updated_at, self.watermark, until
+            ).all()
+            units = changed_between(
+                self._unit_rows(session), BloodUnitInfoModel.updated_at, self.watermark, until
+            ).all()
+
+            #donors first so the units pick up their blood type
+            changes = [("donor", r[0], (r[1], r[2])) for r in donors]
+            changes += [("unit", r[0], (r[1], r[2], r[3])) for r in units]
+            self.apply(changes)
+
+            if self._deleted_elsewhere(session):
+                self.load(session)
+                return {"donors": len(donors), "units": len(units), "reloaded": True}
+            self.max_ids = max_ids
+            self.watermark = until
+            self.synced = time.monotonic()
+            return {"donors": len(donors), "units": len(units), "reloaded": False}
+        finally:
+            self._sync_lock.release()
+
+    def _max_ids(self, session):
+        return {
+            "units": session.query(func.max(BloodUnitInfoModel.unit_id)).scalar() or 0,
+            "donors": session.query(func.max(DonorModel.donor_id)).scalar() or 0
+        }
+
+    #a row deleted by another process leaves no updated_at behind: compares the count and the
+    #sum of the ids that already existed at the last sync (newer rows may not be applied yet)
+    def _deleted_elsewhere(self, session):
+        for name, columns, column in [
+            ("units", self.units, BloodUnitInfoModel.unit_id),
+            ("donors", self.donors, DonorModel.donor_id)
+        ]:
+            last = self.max_ids[name]
+            count, total = session.query(func.count(column), func.sum(column)).filter(column <= last).one()
+            with self._lock:
+                ids = columns["id"]
+                ids = ids[(ids != NO_CODE) & (ids <= last)]
+                live = (len(ids), int(ids.sum()))
+            if (count, int(total or 0)) != live:
+                return True
+        return False
+
+    def _donor_type(self, donor_id):
+        i = self.donors.rows.get(donor_id)
+        return NO_CODE if i is None else self.donors.data["blood_type"][i]
+
+    #------------------------------deltas------------------------------#
+    def apply(self, changes):
+        with self._lock:
+            relink = False
+            for kind, row_id, values in changes:
+                if kind == "unit":
+                    self._apply_unit(row_id, values)
+                elif kind == "donor":
+                    relink |= self._apply_donor(row_id, values)
+                elif kind == "unit-deleted":
+                    self._delete(self.units, row_id)
+                elif kind == "donor-deleted":
+                    relink |= self._delete(self.donors, row_id) is not None
+            if relink:
+                self._link_blood_types()
+
+    def _apply_unit(self, unit_id, values):
+        donor_id, expiry, status = values
+        self.units.upsert(unit_id, {
+            "donor": NO_CODE if donor_id is None else donor_id,
+            "expiry": _ordinal(expiry),
+            "status": _code(status, _STATUS_CODES),
+            "blood_type": self._donor_type(donor_id)
+        })
+
+    #returns True when the donor's units need their blood type updated
+    def _apply_donor(self, donor_id, values):
+        blood_type, last_donated = values
+        code = _code(blood_type, _TYPE_CODES)
+        i = self.donors.rows.get(donor_id)
+        changed = i is None or self.donors.data["blood_type"][i] != code
+        self.donors.upsert(donor_id, {"blood_type": code, "last_donated": _ordinal(last_donated)})
+        return changed
+
+    def _delete(self, columns, row_id):
+        i = columns.remove(row_id)
+        if i is not None:
+            columns.data["id"][i] = NO_CODE
+            if "status" in columns.data:
+                columns.data["status"][i] = DELETED_CODE
+            else:
+                columns.data["blood_type"][i] = DELETED_CODE
+        return i
+
+    #------------------------------queries------------------------------#
+    def _live_units(self):
+        return self.units["status"] != DELETED_CODE
+
+    def _live_donors(self):
+        return self.donors["blood_type"] != DELETED_CODE
+
+    def _expiring_mask(self, today, days):
+        expiry = self.units["expiry"]
+        start = today.toordinal()
+        return (expiry >= start) & (expiry <= start + days) & (self.units["status"] == AVAILABLE)
+
+    def _expired_mask(self, today):
+        expiry = self.units["expiry"]
+        status = self.units["status"]
+        #sql "unit_status != 'Expired'" also skips NULL statuses
+        known = (status != EXPIRED) & (status != NO_CODE) & (status != DELETED_CODE)
+        return (expiry != NO_DATE) & (expiry < today.toordinal()) & known
+
+    def _eligible_mask(self, today, days=60):
+        last = self.donors["last_donated"]
+        return self._live_donors() & ((last == NO_DATE) | (last <= today.toordinal() - days))
+
+    def expiring_unit_ids(self, today, days=20):
+        with self._lock:
+            return self.units["id"][self._expiring_mask(today, days)].tolist()
+
+    def expired_unit_ids(self, today):
+        with self._lock:
+            return self.units["id"][self._expired_mask(today)].tolist()
+
+    def eligible_donor_ids(self, today):
+        with self._lock:
+            return self.donors["id"][self._eligible_mask(today)].tolist()
+
+    def count_expiring(self, today, days=20):
+        with self._lock:
+            return int(np.count_nonzero(self._expiring_mask(today, days)))
+
+    def count_expired(self, today):
+        with self._lock:
+            return int(np.count_nonzero(self._expired_mask(today)))
+
+    def count_eligible(self, today):
+        with self._lock:
+            return int(np.count_nonzero(self._eligible_mask(today)))
+
+    def count_units(self, status=None):
+        with self._lock:
+            if status is None:
+                return int(np.count_nonzero(self._live_units()))
+            return int(np.count_nonzero(self.units["status"] == _code(status, _STATUS_CODES)))
+
+    def count_donors(self):
+        with self._lock:
+            return int(np.count_nonzero(self._live_donors()))
+
+    def inventory_by_blood_type(self):
+        with self._lock:
+            types = self.units["blood_type"][(self.units["status"] == AVAILABLE) & (self.units["blood_type"] >= 0)]
+            counts = np.bincount(types, minlength=len(BLOOD_TYPES))
+        return {bt: int(counts[i]) for i, bt in enumerate(BLOOD_TYPES)}
+
+
+#----------------------------------engine registry-----------------------------------#
+#one engine per site (None is the default database), loaded on first use
+
+_engines = {}
+_registry_lock = threading.Lock()
+_enabled = False
+
+
+def enable_analytics():
+    global _enabled, np
+    try:
+        import numpy as np
+    except ImportError:
+        raise RuntimeError("ANALYTICS_ENGINE requires numpy to be installed")
+    if not _enabled:
+        event.listen(SiteSession, "after_flush", _collect_changes)
+        event.listen(SiteSession, "after_commit", _apply_changes)
+        event.listen(SiteSession, "after_rollback", _discard_changes)
+        _enabled = True
+
+
+def disable_analytics():
+    global _enabled
+    if _enabled:
+        event.remove(SiteSession, "after_flush", _collect_changes)
+        event.remove(SiteSession, "after_commit", _apply_changes)
+        event.remove(SiteSession, "after_rollback", _discard_changes)
+        _enabled = False
+    with _registry_lock:
+        _engines.clear()
+
+
+#returns the engine of the current site, or None when the engine is disabled.
+#the first call loads it, after that it is resynced with the database in the background
+#every ANALYTICS_SYNC_SECONDS (0 turns the resync off)
+def get_engine():
+    if not _enabled:
+        return None
+    site = current_site()
+    engine = _engines.get(site)
+    if engine is None:
+        with _registry_lock:
+            engine = _engines.get(site)
+            if engine is None:
+                engine = InventoryEngine().load(db.session)
+                _engines[site] = engine
+    interval = current_app.config["ANALYTICS_SYNC_SECONDS"]
+    if interval and engine.claim_sync(interval):
+        engine.sync_thread = run_in_background(
+            engine.sync, db.session, reload_after=current_app.config["ANALYTICS_RELOAD_SECONDS"]
+        )
+    return engine
+
+
+#records the flushed unit/donor changes, they are applied only once the commit succeeds
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault("analytics_changes", [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, BloodUnitInfoModel):
+            changes.append(("unit", obj.unit_id, (obj.donor_id, obj.expiry_date, obj.unit_status)))
+        elif isinstance(obj, DonorModel):
+            changes.append(("donor", obj.donor_id, (obj.blood_type, obj.last_donated_date)))
+    for obj in session.deleted:
+        if isinstance(obj, BloodUnitInfoModel):
+            changes.append(("unit-deleted", obj.unit_id, None))
+        elif isinstance(obj, DonorModel):
+            changes.append(("donor-deleted", obj.donor_id, None))
+    if changes:
+        session.info["analytics_site"] = current_site()
+
+
+def _apply_changes(session):
+    changes = session.info.pop("analytics_changes", None)
+    site = session.info.pop("analytics_site", None)
+    engine = _engines.get(site)
+    if changes and engine is not None:
+        engine.apply(changes)
+
+
+def _discard_changes(session):
+    session.info.pop("analytics_changes", None)
+    session.info.pop("analytics_site", None)
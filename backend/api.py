@@ -1,9 +1,8 @@
-from flask import Flask, request
+from flask import request
 from flask_cors import CORS
-from dotenv import load_dotenv
 from flask_restful import Resource, Api, marshal_with, reqparse, fields, abort
-from database import db
-import os
+from database import db, commit_versioned, ConflictError
+from datetime import datetime
 from functions import (
     get_expiring_units, 
     get_expired_units, 
@@ -16,28 +15,15 @@ from functions import (
     get_request_by_status,
     get_summary,
     get_low_stock,
-    get_donors_by_drive
+    get_donors_by_drive,
+    get_network_inventory,
+    get_transfer_candidates,
+    get_transfer_proposals,
+    create_transfers
 )
-
-load_dotenv()
-
-app = Flask(__name__)
-CORS(app)
-
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_NAME = os.getenv("DB_NAME")
-DB_PORT = os.getenv("DB_PORT")
-
-app.config["SQLALCHEMY_DATABASE_URI"] = (
-    f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-)
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False 
-
-db.init_app(app)
-api = Api(app)
-
+from sites import current_site
+from throttle import single_flight, rate_limited, get_throttle_stats
+from idempotency import idempotent
 from models import DonorModel, HospitalModel, BloodUnitInfoModel, RequestModel, BloodDriveModel
 
 #json format fields
@@ -49,7 +35,8 @@ donor_fields = {
     "blood_type": fields.String,
     "phone_num": fields.String,
     "last_donated_date": fields.String,
-    "drive_id": fields.Integer
+    "drive_id": fields.Integer,
+    "site_id": fields.String
 }
 
 hospital_fields = {
@@ -63,7 +50,9 @@ bloodunit_fields = {
     "donor_id": fields.Integer,
     "donation_date": fields.String,
     "expiry_date": fields.String,
-    "unit_status": fields.String
+    "unit_status": fields.String,
+    "site_id": fields.String,
+    "version": fields.Integer
 }
 
 request_fields = {
@@ -72,7 +61,9 @@ request_fields = {
     "unit_id": fields.Integer,
     "request_date": fields.String,
     "req_status": fields.String,
-    "completed_date": fields.String
+    "completed_date": fields.String,
+    "site_id": fields.String,
+    "version": fields.Integer
 }
 
 blooddrive_fields = {
@@ -85,6 +76,10 @@ blooddrive_fields = {
     "last_drive_date": fields.String
 }
 
+#dates are parsed into date objects so every backend (mysql or the sqlite site shards) accepts them
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
 #request parsers: request parser validates and extracts data from incoming HTTP requests
 donor_args = reqparse.RequestParser()
 donor_args.add_argument("first_name", type=str, required=True, help="First name cannot be blank")
@@ -93,7 +88,7 @@ donor_args.add_argument("blood_type", type=str, required=True,
                        choices=["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"],
                        help='Invalid blood type, must be one of: "A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"')
 donor_args.add_argument("phone_num", type=str, required=True, help="Phone number cannot be blank")
-donor_args.add_argument("last_donated_date", type=str, required=True, help="Date required (YYYY-MM-DD)")
+donor_args.add_argument("last_donated_date", type=parse_date, required=True, help="Date required (YYYY-MM-DD)")
 donor_args.add_argument("drive_id", type=int, required=False, help="Blood drive ID")
 donor_args.add_argument("drive_id", type=int, required=False, help="Blood drive ID")
 
@@ -103,8 +98,8 @@ hospital_args.add_argument("address", type=str, required=True, help="Address can
 
 bloodunit_args = reqparse.RequestParser()
 bloodunit_args.add_argument("donor_id", type=int, required=False)
-bloodunit_args.add_argument("donation_date", type=str, required=True, help="Donation date required")
-bloodunit_args.add_argument("expiry_date", type=str, required=True, help="Expiry date required")
+bloodunit_args.add_argument("donation_date", type=parse_date, required=True, help="Donation date required")
+bloodunit_args.add_argument("expiry_date", type=parse_date, required=True, help="Expiry date required")
 bloodunit_args.add_argument("unit_status", type=str, required=True,
                            choices=["Available", "Reserved", "Issued", "Transfused", "Expired", "Discarded"],
                            help='Invalid status, must be one of: "Available", "Reserved", "Issued", "Transfused", "Expired", "Discarded"')
@@ -112,11 +107,11 @@ bloodunit_args.add_argument("unit_status", type=str, required=True,
 request_args = reqparse.RequestParser()
 request_args.add_argument("hospital_id", type=int, required=True)
 request_args.add_argument("unit_id", type=int, required=True)
-request_args.add_argument("request_date", type=str, required=True, help="Request date required (YYYY-MM-DD)")
+request_args.add_argument("request_date", type=parse_date, required=True, help="Request date required (YYYY-MM-DD)")
 request_args.add_argument("req_status", type=str, required=True,
                          choices=["Approved", "Pending", "Processing", "Transit", "Completed", "Cancelled"],
                          help="Invalid status")
-request_args.add_argument("completed_date", type=str, required=False, help="Completion Date: (YYYY-MM-DD)")
+request_args.add_argument("completed_date", type=parse_date, required=False, help="Completion Date: (YYYY-MM-DD)")
 
 blooddrive_args = reqparse.RequestParser()
 blooddrive_args.add_argument("drive_name", type=str, required=True, help="Drive name cannot be blank")
@@ -124,12 +119,58 @@ blooddrive_args.add_argument("drive_address", type=str, required=True, help="Dri
 blooddrive_args.add_argument("manager_last_name", type=str, required=True, help="Manager last name cannot be blank")
 blooddrive_args.add_argument("manager_first_name", type=str, required=True, help="Manager first name cannot be blank")
 blooddrive_args.add_argument("phone_num", type=str, required=True, help="Phone number cannot be blank")
-blooddrive_args.add_argument("last_drive_date", type=str, required=True, help="Last drive date required (YYYY-MM-DD)")
+blooddrive_args.add_argument("last_drive_date", type=parse_date, required=True, help="Last drive date required (YYYY-MM-DD)")
+
+#optimistic concurrency for units and requests: GET returns the row version as an ETag,
+#PATCH/DELETE with If-Match only apply to that version (412 otherwise), and a concurrent
+#write that changed the row between our read and commit is answered with 409
+def etag(row):
+    return {"ETag": f'"{row.version}"'}
+
+def check_if_match(row):
+    if_match = request.headers.get("If-Match")
+    if if_match is None or if_match.strip() == "*":
+        return
+    versions = [v.strip().replace("W/", "", 1).strip('"') for v in if_match.split(",")]
+    if str(row.version) not in versions:
+        abort(412, message="Resource was modified, reload it and retry", version=row.version)
+
+def commit_or_conflict():
+    try:
+        commit_versioned()
+    except ConflictError as e:
+        abort(409, message=str(e))
+
+#an open request holds its unit as Reserved: closing it releases the unit (Cancelled) or
+#issues it (Completed), reopening it reserves the unit again if it is still available.
+#the unit is changed in the same versioned commit as the request
+CLOSED_STATUSES = ["Completed", "Cancelled"]
+
+def reserve_unit(unit_id):
+    unit = BloodUnitInfoModel.query.filter_by(unit_id=unit_id).first()
+    if not unit:
+        abort(404, message="Blood Unit not Found")
+    if unit.unit_status != "Available":
+        abort(409, message=f"Blood Unit is {unit.unit_status}, not Available")
+    unit.unit_status = "Reserved"
+
+def update_request_unit(req, new_status):
+    was_open = req.req_status not in CLOSED_STATUSES
+    if was_open == (new_status not in CLOSED_STATUSES):
+        return
+    if not was_open:
+        reserve_unit(req.unit_id)
+        return
+    unit = BloodUnitInfoModel.query.filter_by(unit_id=req.unit_id).first()
+    if unit is not None and unit.unit_status == "Reserved":
+        unit.unit_status = "Issued" if new_status == "Completed" else "Available"
 
 # resources: class that represents a specific endpoint in your API. 
 # It groups together all the HTTP methods (GET, POST, PUT, DELETE) for a particular type of data.
 #----------------------------------------------------donors----------------------------------------#
 class Donors(Resource):
+    method_decorators = {"post": [idempotent]}
+
     #get all donors
     @marshal_with(donor_fields)
     def get(self):
@@ -146,7 +187,8 @@ class Donors(Resource):
             blood_type=args["blood_type"],
             phone_num=args["phone_num"],
             last_donated_date=args["last_donated_date"],
-            drive_id=args["drive_id"]
+            drive_id=args["drive_id"],
+            site_id=current_site()
         )
         db.session.add(donor)
         db.session.commit()
@@ -194,6 +236,8 @@ class Donor(Resource):
 
 #----------------------------------------------hospitals-------------------------------------------#
 class Hospitals(Resource):
+    method_decorators = {"post": [idempotent]}
+
     #get all hospitals
     @marshal_with(hospital_fields) 
     def get(self):
@@ -248,6 +292,8 @@ class Hospital(Resource):
 
 #----------------------------------------------bloodunits---------------------------------------------------#
 class BloodUnits(Resource):
+    method_decorators = {"post": [idempotent]}
+
     #gets all blood unit informations
     @marshal_with(bloodunit_fields)
     def get(self):
@@ -261,7 +307,8 @@ class BloodUnits(Resource):
         blood_unit = BloodUnitInfoModel(donor_id = args["donor_id"],
                                         donation_date = args["donation_date"],
                                         expiry_date = args["expiry_date"],
-                                        unit_status = args["unit_status"])
+                                        unit_status = args["unit_status"],
+                                        site_id = current_site())
         db.session.add(blood_unit)
         db.session.commit()
 
@@ -275,7 +322,7 @@ class BloodUnit(Resource):
         unit = BloodUnitInfoModel.query.filter_by(unit_id=id).first()
         if not unit:
             abort(404, "Blood Unit not Found")
-        return unit
+        return unit, 200, etag(unit)
 
     #edit a bloodunit (unit status for now)
     @marshal_with(bloodunit_fields)
@@ -285,10 +332,11 @@ class BloodUnit(Resource):
         
         if not unit:
             abort(404, "Blood Unit not Found")
+        check_if_match(unit)
         
         unit.unit_status = args["unit_status"]
-        db.session.commit()
-        return unit
+        commit_or_conflict()
+        return unit, 200, etag(unit)
 
     #delete a blood unit(for testing may remove)
     @marshal_with(bloodunit_fields)
@@ -296,14 +344,17 @@ class BloodUnit(Resource):
         unit = BloodUnitInfoModel.query.filter_by(unit_id=id).first()
         if not unit:
             abort(404, "Blood Unit not Found")
+        check_if_match(unit)
         db.session.delete(unit)
-        db.session.commit()
+        commit_or_conflict()
 
         units = BloodUnitInfoModel.query.all()
         return units, 201
     
 #-----------------------------------------requests------------------------------------------------------#
 class Requests(Resource):
+    method_decorators = {"post": [idempotent]}
+
     #gets all the requests
     @marshal_with(request_fields)
     def get(self):
@@ -314,13 +365,20 @@ class Requests(Resource):
     @marshal_with(request_fields)
     def post(self):
         args = request_args.parse_args()
+
+        #an open request reserves its unit, so only an available unit can be requested;
+        #two dispatchers racing for the same unit get a 409 instead of a duplicate
+        if args["req_status"] not in CLOSED_STATUSES:
+            reserve_unit(args["unit_id"])
+
         request = RequestModel(hospital_id=args["hospital_id"],
                                unit_id=args["unit_id"],
                                request_date=args["request_date"],
                                req_status=args["req_status"],
-                               completed_date=args["completed_date"])
+                               completed_date=args["completed_date"],
+                               site_id=current_site())
         db.session.add(request)
-        db.session.commit()
+        commit_or_conflict()
 
         requests = RequestModel.query.all()
         return requests, 201
@@ -332,7 +390,7 @@ class Request(Resource):
         request = RequestModel.query.filter_by(request_id=id).first()
         if not request:
             abort(404, "Request not found")
-        return request
+        return request, 200, etag(request)
 
     #edits a request
     @marshal_with(request_fields)
@@ -341,12 +399,14 @@ class Request(Resource):
         request = RequestModel.query.filter_by(request_id=id).first()
         if not request:
             abort(404, "Request not Found")
+        check_if_match(request)
+        update_request_unit(request, args["req_status"])
         
         request.request_date = args["request_date"]
         request.req_status = args["req_status"]
         request.completed_date = args["completed_date"]
-        db.session.commit()
-        return request
+        commit_or_conflict()
+        return request, 200, etag(request)
 
     #deletes a request
     @marshal_with(request_fields)
@@ -354,14 +414,18 @@ class Request(Resource):
         request = RequestModel.query.filter_by(request_id=id).first()
         if not request:
             abort(404, "Request not found")
+        check_if_match(request)
+        update_request_unit(request, "Cancelled")
         db.session.delete(request)
-        db.session.commit()
+        commit_or_conflict()
 
         requests = RequestModel.query.all()
         return requests, 201
 
 #-----------------------------------------blood drives------------------------------------------------------#
 class BloodDrives(Resource):
+    method_decorators = {"post": [idempotent]}
+
     #gets all blood drives
     @marshal_with(blooddrive_fields)
     def get(self):
@@ -426,16 +490,24 @@ class BloodDrive(Resource):
         return drives, 201
 
 #----------------------------------functions-----------------------------------------------#
+#summary, expiring and inventory are rate limited and identical concurrent calls share one computation
 class DashboardSummary(Resource):
+    method_decorators = [rate_limited]
+
     def get(self):
-        summary = get_summary()
+        summary = single_flight.do(("summary", current_site()), get_summary)
         return summary, 200
 
 class ExpiringUnits(Resource):
+    method_decorators = [rate_limited]
+
     def get(self):
         days = request.args.get("days", default=20, type=int)
-        units = get_expiring_units(days=days)
-        return [unit.to_dict() for unit in units], 200
+        units = single_flight.do(
+            ("expiring", current_site(), days),
+            lambda: [unit.to_dict() for unit in get_expiring_units(days=days)]
+        )
+        return units, 200
 
 class ExpiredUnits(Resource):
     def get(self):
@@ -443,13 +515,20 @@ class ExpiredUnits(Resource):
         return [unit.to_dict() for unit in units], 200
 
 class MarkExpired(Resource):
+    method_decorators = [idempotent]
+
     def post(self):
-        count = mark_expired_units()
+        try:
+            count = mark_expired_units()
+        except ConflictError as e:
+            abort(409, message=str(e))
         return {"message": f"{count} units marked as expired", "count": count}, 200
 
 class InventoryByType(Resource):
+    method_decorators = [rate_limited]
+
     def get(self):
-        inventory = get_inventory_by_blood_type()
+        inventory = single_flight.do(("inventory", current_site()), get_inventory_by_blood_type)
         return inventory, 200
 
 class UnitsByBloodType(Resource):
@@ -522,33 +601,91 @@ class DonorsByDrive(Resource):
             "donors": [donor.to_dict() for donor in result["donors"]]
         }, 200
 
+#proposes expiring units for open requests (GET), or moves the requests onto them in one batch (POST)
+class Transfers(Resource):
+    method_decorators = {"get": [rate_limited], "post": [rate_limited, idempotent]}
+
+    def get(self):
+        days = request.args.get("days", default=20, type=int)
+        transfers = single_flight.do(
+            ("transfers", current_site(), days),
+            get_transfer_proposals, days=days
+        )
+        return transfers, 200
+
+    def post(self):
+        days = request.args.get("days", default=20, type=int)
+        transfers = get_transfer_proposals(days=days)
+        try:
+            updated = create_transfers(transfers)
+        except ConflictError as e:
+            abort(409, message=str(e))
+        return {
+            "proposed": len(transfers),
+            "updated": [req.to_dict() for req in updated]
+        }, 200
+
+#----------------------------------network (cross-site)------------------------------------#
+class NetworkInventory(Resource):
+    method_decorators = [rate_limited]
+
+    def get(self):
+        inventory = single_flight.do(("network-inventory",), get_network_inventory)
+        return inventory, 200
+
+class TransferCandidates(Resource):
+    method_decorators = [rate_limited]
+
+    def get(self):
+        days = request.args.get("days", default=20, type=int)
+        amount = request.args.get("amount", default=5, type=int)
+        candidates = single_flight.do(
+            ("transfer-candidates", days, amount),
+            get_transfer_candidates, days=days, amount=amount
+        )
+        return candidates, 200
+
+class ThrottleStats(Resource):
+    def get(self):
+        return get_throttle_stats(), 200
+
 #------------------------------------------------------------------------------------------#
-api.add_resource(Donors, "/api/donors/")
-api.add_resource(Donor, "/api/donors/<int:id>")
-api.add_resource(Hospitals, "/api/hospitals/")
-api.add_resource(Hospital, "/api/hospitals/<int:id>")
-api.add_resource(BloodUnits, "/api/bloodunits/")
-api.add_resource(BloodUnit, "/api/bloodunits/<int:id>")
-api.add_resource(Requests, "/api/requests/")
-api.add_resource(Request, "/api/requests/<int:id>")
-api.add_resource(BloodDrives, "/api/blooddrives/")
-api.add_resource(BloodDrive, "/api/blooddrives/<int:id>")
-api.add_resource(DashboardSummary, "/api/function/summary")
-api.add_resource(ExpiringUnits, "/api/function/expiring")
-api.add_resource(ExpiredUnits, "/api/function/expired")
-api.add_resource(MarkExpired, "/api/function/mark-expired")
-api.add_resource(InventoryByType, "/api/function/inventory")
-api.add_resource(UnitsByBloodType, "/api/function/units-by-type")
-api.add_resource(DonorsByBloodType, "/api/function/donors-by-type")
-api.add_resource(EligibleDonors, "/api/function/eligible-donors")
-api.add_resource(UrgentRequests, "/api/function/urgent-requests")
-api.add_resource(RequestsByStatus, "/api/function/requests-by-status")
-api.add_resource(LowStockAlerts, "/api/function/low-stock")
-api.add_resource(DonorsByDrive, "/api/function/donors-by-drive")
-
-@app.route("/")
 def home():
     return "<h1>Blood Bank REST API</h1>"
 
+#registers cors and every resource on an app built by factory.create_app
+def register_api(app):
+    CORS(app)
+    api = Api(app)
+
+    api.add_resource(Donors, "/api/donors/")
+    api.add_resource(Donor, "/api/donors/<int:id>")
+    api.add_resource(Hospitals, "/api/hospitals/")
+    api.add_resource(Hospital, "/api/hospitals/<int:id>")
+    api.add_resource(BloodUnits, "/api/bloodunits/")
+    api.add_resource(BloodUnit, "/api/bloodunits/<int:id>")
+    api.add_resource(Requests, "/api/requests/")
+    api.add_resource(Request, "/api/requests/<int:id>")
+    api.add_resource(BloodDrives, "/api/blooddrives/")
+    api.add_resource(BloodDrive, "/api/blooddrives/<int:id>")
+    api.add_resource(DashboardSummary, "/api/function/summary")
+    api.add_resource(ExpiringUnits, "/api/function/expiring")
+    api.add_resource(ExpiredUnits, "/api/function/expired")
+    api.add_resource(MarkExpired, "/api/function/mark-expired")
+    api.add_resource(InventoryByType, "/api/function/inventory")
+    api.add_resource(UnitsByBloodType, "/api/function/units-by-type")
+    api.add_resource(DonorsByBloodType, "/api/function/donors-by-type")
+    api.add_resource(EligibleDonors, "/api/function/eligible-donors")
+    api.add_resource(UrgentRequests, "/api/function/urgent-requests")
+    api.add_resource(RequestsByStatus, "/api/function/requests-by-status")
+    api.add_resource(LowStockAlerts, "/api/function/low-stock")
+    api.add_resource(DonorsByDrive, "/api/function/donors-by-drive")
+    api.add_resource(Transfers, "/api/function/transfers")
+    api.add_resource(NetworkInventory, "/api/network/inventory")
+    api.add_resource(TransferCandidates, "/api/network/transfer-candidates")
+    api.add_resource(ThrottleStats, "/api/function/throttle-stats")
+    app.add_url_rule("/", view_func=home)
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    from factory import create_app
+    create_app().run(debug=True)
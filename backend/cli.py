@@ -0,0 +1,147 @@
+import time
+
+_started = time.perf_counter()
+
+import argparse
+import csv
+import json
+import sys
+
+#----------------------------------batch cli-----------------------------------#
+#runs functions.py operations without the web stack:
+#   python cli.py sweep                       marks expired units
+#   python cli.py summary                     prints the dashboard summary
+#   python cli.py export units -o units.csv   exports a table (csv or json)
+#   python cli.py snapshot -o snap.json       saves summary, low stock and expiring units
+#   python cli.py refresh-summaries [--full]  folds recent changes into the summary tables
+#--site runs against one site shard, --timing prints the startup time to stderr
+
+EXPORT_TABLES = ["donors", "hospitals", "units", "requests", "drives"]
+
+
+def _models():
+    from models import DonorModel, HospitalModel, BloodUnitInfoModel, RequestModel, BloodDriveModel
+    return {
+        "donors": DonorModel,
+        "hospitals": HospitalModel,
+        "units": BloodUnitInfoModel,
+        "requests": RequestModel,
+        "drives": BloodDriveModel
+    }
+
+
+def _write_json(data, output):
+    text = json.dumps(data, indent=2, default=str)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def sweep(args):
+    from functions import mark_expired_units
+    count = mark_expired_units()
+    print(f"{count} units marked as expired")
+
+
+def summary(args):
+    from functions import get_summary
+    _write_json(get_summary(), args.output)
+
+
+def export(args):
+    model = _models()[args.table]
+    rows = [row.to_dict() for row in model.query.all()]
+
+    if args.format == "json":
+        _write_json(rows, args.output)
+        return
+
+    f = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        columns = [column.name for column in model.__table__.columns]
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def snapshot(args):
+    from functions import get_summary, get_low_stock, get_expiring_units
+    _write_json({
+        "summary": get_summary(),
+        "low_stock": get_low_stock(amount=args.amount),
+        "expiring": [unit.to_dict() for unit in get_expiring_units(days=args.days)]
+    }, args.output)
+
+
+def refresh(args):
+    from summaries import refresh_summaries
+    result = refresh_summaries(full=args.full)
+    print(f"{result['units']} units and {result['donors']} donors refreshed")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Blood bank batch jobs")
+    parser.add_argument("--site", help="site shard to run against (see SITE_SHARDS)")
+    parser.add_argument("--timing", action="store_true", help="print startup and run time to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("sweep", help="mark units past their expiry date as expired").set_defaults(run=sweep)
+
+    summary_parser = commands.add_parser("summary", help="print the dashboard summary")
+    summary_parser.add_argument("-o", "--output", help="write to a file instead of stdout")
+    summary_parser.set_defaults(run=summary)
+
+    export_parser = commands.add_parser("export", help="export a table")
+    export_parser.add_argument("table", choices=EXPORT_TABLES)
+    export_parser.add_argument("-f", "--format", choices=["csv", "json"], default="csv")
+    export_parser.add_argument("-o", "--output", help="write to a file instead of stdout")
+    export_parser.set_defaults(run=export)
+
+    snapshot_parser = commands.add_parser("snapshot", help="save summary, low stock and expiring units")
+    snapshot_parser.add_argument("-o", "--output", help="write to a file instead of stdout")
+    snapshot_parser.add_argument("--days", type=int, default=20, help="expiring window in days")
+    snapshot_parser.add_argument("--amount", type=int, default=5, help="low stock threshold")
+    snapshot_parser.set_defaults(run=snapshot)
+
+    refresh_parser = commands.add_parser("refresh-summaries", help="refresh the summary tables")
+    refresh_parser.add_argument("--full", action="store_true", help="rebuild them from scratch")
+    refresh_parser.set_defaults(run=refresh)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    from flask import g
+    from database import ConflictError
+    from factory import create_app
+    from sites import get_sites
+
+    app = create_app(with_api=False)
+    with app.app_context():
+        if args.site is not None and args.site not in get_sites():
+            print(f"Unknown site: {args.site}", file=sys.stderr)
+            return 2
+        g.site = args.site
+
+        ready = time.perf_counter()
+        try:
+            args.run(args)
+        except ConflictError as e:
+            print(f"Conflict: {e}", file=sys.stderr)
+            return 1
+        done = time.perf_counter()
+
+    if args.timing:
+        print(f"startup {(ready - _started) * 1000:.1f} ms, {args.command} {(done - ready) * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,66 @@
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import inspect, select, func
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.sql.util import find_tables
 
-db = SQLAlchemy()
\ No newline at end of file
+
+#tables that live on each site's shard are marked with info={"site_partitioned": True},
+#everything else (hospitals, blood drives) is shared and stays on the default database
+SITE_PARTITIONED = {"info": {"site_partitioned": True}}
+
+
+def is_site_partitioned(mapper=None, clause=None):
+    if mapper is not None:
+        tables = [inspect(mapper).local_table]
+    elif clause is not None:
+        tables = find_tables(clause, include_aliases=True, include_crud=True)
+    else:
+        return False
+    return any(table.info.get("site_partitioned") for table in tables)
+
+
+#routes queries on partitioned tables to the shard of the site selected for the current
+#app context (g.site), shared tables and requests without a site use the default database
+class SiteSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            site = g.get("site")
+            if site is not None and is_site_partitioned(mapper, clause):
+                return self._db.engines[site]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": SiteSession})
+
+
+#a versioned row (units, requests) was changed by another transaction between our read and commit
+class ConflictError(Exception):
+    pass
+
+
+#commits db.session, a lost race on a versioned row rolls back and raises ConflictError
+def commit_versioned():
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        raise ConflictError("Resource was modified by another request, reload it and retry")
+
+
+#incremental readers (analytics engine, summary tables) read the rows of a model whose
+#updated_at falls in [since, until). until is the database clock minus `settle`, cut to whole
+#seconds, so a second is only read once it is over and a row changed twice within the same
+#second can't slip past the watermark. settle must be at least a second (sqlite stores
+#CURRENT_TIMESTAMP without fractions)
+def settled_until(session, model, settle):
+    now = session.execute(select(func.now()), bind_arguments={"mapper": model}).scalar()
+    return now.replace(microsecond=0) - settle
+
+
+#since=None reads every row
+def changed_between(query, column, since, until):
+    if since is None:
+        return query
+    return query.filter(column >= since, column < until)
@@ -0,0 +1,62 @@
+import os
+from dotenv import load_dotenv
+from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
+from database import db
+from sites import configure_sites, select_site
+
+#----------------------------------app factory-----------------------------------#
+#builds the flask app on demand instead of at import time.
+#with_api=False gives a bare app (config + database only) for batch jobs and the cli,
+#the rest api (flask-restful, cors and all the resources) is only imported when with_api=True
+
+
+def create_app(with_api=True, config=None):
+    load_dotenv()
+
+    app = Flask(__name__)
+
+    DB_USER = os.getenv("DB_USER")
+    DB_PASSWORD = os.getenv("DB_PASSWORD")
+    DB_HOST = os.getenv("DB_HOST")
+    DB_NAME = os.getenv("DB_NAME")
+    DB_PORT = os.getenv("DB_PORT")
+
+    #DATABASE_URL overrides the mysql settings (e.g. sqlite:///blood_bank.db for local runs)
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL") or (
+        f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    )
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    #token bucket of the rate limited endpoints, per client and endpoint
+    app.config["RATE_LIMIT_RATE"] = float(os.getenv("RATE_LIMIT_RATE", 5))
+    app.config["RATE_LIMIT_CAPACITY"] = float(os.getenv("RATE_LIMIT_CAPACITY", 10))
+    #number of reverse proxies in front of the app whose X-Forwarded-For can be trusted
+    app.config["TRUSTED_PROXIES"] = int(os.getenv("TRUSTED_PROXIES", 0))
+    #how often the analytics engine picks up writes made by other processes (0 = never),
+    #and how often it reloads everything to catch transactions that committed late
+    app.config["ANALYTICS_SYNC_SECONDS"] = float(os.getenv("ANALYTICS_SYNC_SECONDS", 5))
+    app.config["ANALYTICS_RELOAD_SECONDS"] = float(os.getenv("ANALYTICS_RELOAD_SECONDS", 600))
+    #how often a read of the summary tables may start a background refresh (0 = never)
+    app.config["SUMMARY_REFRESH_SECONDS"] = float(os.getenv("SUMMARY_REFRESH_SECONDS", 5))
+    if config:
+        app.config.update(config)
+    if app.config["RATE_LIMIT_RATE"] <= 0 or app.config["RATE_LIMIT_CAPACITY"] < 1:
+        raise ValueError("RATE_LIMIT_RATE must be positive and RATE_LIMIT_CAPACITY at least 1")
+    configure_sites(app)
+
+    db.init_app(app)
+    app.before_request(select_site)
+
+    if app.config["TRUSTED_PROXIES"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+
+    #optional numpy analytics engine for the inventory/summary functions
+    if os.getenv("ANALYTICS_ENGINE"):
+        from analytics import enable_analytics
+        enable_analytics()
+
+    if with_api:
+        from api import register_api
+        register_api(app)
+
+    return app
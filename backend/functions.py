@@ -1,7 +1,14 @@
 from datetime import datetime, timedelta
-from models import BloodUnitInfoModel, DonorModel, RequestModel, HospitalModel
-from database import db
+from models import (
+    BloodUnitInfoModel, DonorModel, RequestModel, HospitalModel,
+    AvailableUnitSummaryModel, DonorEligibilitySummaryModel, InventorySummaryModel
+)
+from database import db, commit_versioned
 from sqlalchemy import func
+from sites import fan_out
+from analytics import get_engine
+from transfers import plan_transfers
+from summaries import schedule_refresh
 
 #----------functions for blood units -------------#
 #we are using December 1st, 2025 for reference
@@ -12,6 +19,10 @@ def get_expiring_units(days = 20):
     today = datetime(2025, 12, 1).date()
     cutoff_date = today + timedelta(days=days)
 
+    engine = get_engine()
+    if engine is not None:
+        return _get_by_ids(BloodUnitInfoModel, BloodUnitInfoModel.unit_id, engine.expiring_unit_ids(today, days))
+
     return BloodUnitInfoModel.query.filter(
         BloodUnitInfoModel.expiry_date <= cutoff_date,
         BloodUnitInfoModel.expiry_date >= today,
@@ -23,12 +34,23 @@ def get_expiring_units(days = 20):
 def get_expired_units():
     today = datetime(2025, 12, 1).date()
 
+    engine = get_engine()
+    if engine is not None:
+        return _get_by_ids(BloodUnitInfoModel, BloodUnitInfoModel.unit_id, engine.expired_unit_ids(today))
+
     return BloodUnitInfoModel.query.filter(
         BloodUnitInfoModel.expiry_date < today,
         BloodUnitInfoModel.unit_status != "Expired"
     ).all()
 
 
+#loads the rows picked by the analytics engine by primary key
+def _get_by_ids(model, column, ids):
+    if not ids:
+        return []
+    return model.query.filter(column.in_(ids)).all()
+
+
 #marking all units that has passed the date and returns the # of marked
 def mark_expired_units():
     today = datetime(2025, 12, 1).date()
@@ -42,7 +64,7 @@ def mark_expired_units():
         unit.unit_status = "Expired"
         count += 1
     
-    db.session.commit()
+    commit_versioned()
     return count
 
 
@@ -59,6 +81,10 @@ def get_units_by_blood_type(blood_type, status="Available"):
 
 #get the inventory of all blood types
 def get_inventory_by_blood_type():
+    engine = get_engine()
+    if engine is not None:
+        return engine.inventory_by_blood_type()
+
     results = db.session.query(
         DonorModel.blood_type,
         func.count(BloodUnitInfoModel.unit_id).label("count")
@@ -92,6 +118,10 @@ def get_donors_by_blood_type(blood_type):
 def get_eligible_donors():
     today = datetime(2025, 12, 1).date()
     cutoff_date = today - timedelta(days=60)
+
+    engine = get_engine()
+    if engine is not None:
+        return _get_by_ids(DonorModel, DonorModel.donor_id, engine.eligible_donor_ids(today))
     
     return DonorModel.query.filter(
         (DonorModel.last_donated_date <= cutoff_date) | 
@@ -127,6 +157,9 @@ def get_donors_by_drive(drive_id):
 #generating a quick summary of all alerts
 def get_summary():
     today = datetime(2025, 12, 1).date()
+    engine = get_engine()
+    if engine is not None:
+        return _get_summary_from_engine(engine, today)
     
     stats = {
         "system_date": str(today),
@@ -149,15 +182,232 @@ def get_summary():
     return stats
 
 
+#same summary with the unit/donor counts answered by the in-memory analytics engine
+def _get_summary_from_engine(engine, today):
+    return {
+        "system_date": str(today),
+        "total_donors": engine.count_donors(),
+        "eligible_donors": engine.count_eligible(today),
+        "total_hospitals": HospitalModel.query.count(),
+        "total_units": engine.count_units(),
+        "available_units": engine.count_units(status="Available"),
+        "expiring_24h": engine.count_expiring(today, days=1),
+        "expiring_7days": engine.count_expiring(today, days=7),
+        "expired_units": engine.count_expired(today),
+        "urgent_requests": len(get_urgent_requests()),
+        "pending_requests": RequestModel.query.filter_by(req_status="Pending").count(),
+        "completed_requests_today": RequestModel.query.filter(
+            RequestModel.completed_date == today
+        ).count(),
+        "inventory_by_type": engine.inventory_by_blood_type()
+    }
+
+
 #get units that are low on stock (threshold is 5)
 def get_low_stock(amount = 5):
     inventory = get_inventory_by_blood_type()
     return {bt: count for bt, count in inventory.items() if count < amount}
 
-    
+
+#-------------------------------network (cross-site)-------------------------------#
+
+#inventory of every site added together, plus each site's own inventory
+def get_network_inventory():
+    per_site = fan_out(get_inventory_by_blood_type)
+
+    total = {
+        "A+": 0, "A-": 0, "B+": 0, "B-": 0,
+        "AB+": 0, "AB-": 0, "O+": 0, "O-": 0
+    }
+    for inventory in per_site.values():
+        for blood_type, count in inventory.items():
+            total[blood_type] += count
+
+    return {"total": total, "sites": per_site}
+
+
+#expiring units (with their blood type) and low stock of the current site
+def _site_transfer_snapshot(days, amount):
+    expiring = _get_expiring_units_with_type(days)
+    return {"expiring": expiring, "low_stock": get_low_stock(amount=amount)}
+
+
+#units about to expire at one site whose blood type is low at another site
+#destinations are ordered from the lowest stock up, candidates from the soonest expiry
+def get_transfer_candidates(days=20, amount=5):
+    snapshots = fan_out(_site_transfer_snapshot, days, amount)
+
+    candidates = []
+    for site, snapshot in snapshots.items():
+        for unit in snapshot["expiring"]:
+            blood_type = unit["blood_type"]
+            targets = [
+                other for other, other_snapshot in snapshots.items()
+                if other != site and blood_type in other_snapshot["low_stock"]
+            ]
+            if not targets:
+                continue
+            targets.sort(key=lambda other: snapshots[other]["low_stock"][blood_type])
+            candidates.append({
+                "from_site": site,
+                "to_sites": targets,
+                "unit": unit
+            })
+
+    candidates.sort(key=lambda c: c["unit"]["expiry_date"])
+    return candidates
 
 
+#-------------------------------transfer functions-------------------------------#
+
+#expiring units as dicts with their donor's blood type added
+def _get_expiring_units_with_type(days):
+    units = get_expiring_units(days=days)
+    donor_ids = [unit.donor_id for unit in units if unit.donor_id is not None]
+    blood_types = dict(db.session.query(DonorModel.donor_id, DonorModel.blood_type).filter(
+        DonorModel.donor_id.in_(donor_ids)
+    ).all()) if donor_ids else {}
+
+    expiring = []
+    for unit in units:
+        info = unit.to_dict()
+        info["blood_type"] = blood_types.get(unit.donor_id)
+        expiring.append(info)
+    return expiring
+
+
+#proposes which expiring unit should be issued to which open (pending/processing) request
+def get_transfer_proposals(days=20):
+    units = [unit for unit in _get_expiring_units_with_type(days) if unit["blood_type"]]
+
+    rows = db.session.query(
+        RequestModel, BloodUnitInfoModel.expiry_date, DonorModel.blood_type
+    ).join(
+        BloodUnitInfoModel, RequestModel.unit_id == BloodUnitInfoModel.unit_id
+    ).join(
+        DonorModel, BloodUnitInfoModel.donor_id == DonorModel.donor_id
+    ).filter(
+        RequestModel.req_status.in_(["Pending", "Processing"])
+    ).all()
+
+    requests = [{
+        "request_id": req.request_id,
+        "hospital_id": req.hospital_id,
+        "unit_id": req.unit_id,
+        "request_date": str(req.request_date) if req.request_date else None,
+        "blood_type": blood_type,
+        "expiry_date": str(expiry_date) if expiry_date else None
+    } for req, expiry_date, blood_type in rows]
+
+    return plan_transfers(units, requests)
+
+
+#applies proposals in one commit: each open request is switched to its expiring unit,
+#which is reserved, and the unit it held goes back to available if it was reserved.
+#the request keeps its status, date and place in the queue.
+#proposals whose unit or request changed since they were computed are skipped
+def create_transfers(transfers):
+    if not transfers:
+        return []
+
+    units = {unit.unit_id: unit for unit in BloodUnitInfoModel.query.filter(
+        BloodUnitInfoModel.unit_id.in_(
+            [t["unit_id"] for t in transfers] + [t["replaces_unit_id"] for t in transfers]
+        )
+    ).all()}
+    requests = {req.request_id: req for req in RequestModel.query.filter(
+        RequestModel.request_id.in_([t["request_id"] for t in transfers])
+    ).all()}
+
+    updated = []
+    for transfer in transfers:
+        unit = units.get(transfer["unit_id"])
+        req = requests.get(transfer["request_id"])
+        if unit is None or unit.unit_status != "Available":
+            continue
+        if req is None or req.req_status not in ["Pending", "Processing"]:
+            continue
+        if req.unit_id != transfer["replaces_unit_id"]:
+            continue
+
+        unit.unit_status = "Reserved"
+        req.unit_id = unit.unit_id
+        old_unit = units.get(transfer["replaces_unit_id"])
+        if old_unit is not None and old_unit.unit_status == "Reserved":
+            old_unit.unit_status = "Available"
+        updated.append(req)
+
+    commit_versioned()
+    return updated
+
+
+#-------------------------------summary tables-------------------------------#
+#same results as the sql views, read from the summary tables. reads never refresh them
+#inline, they start a background refresh instead (see summaries.schedule_refresh), so
+#the results can lag the source tables by a few seconds
+
+#units expiring within `days` days, soonest first (view_expiring_units)
+def get_expiring_units_summary(days=20):
+    today = datetime(2025, 12, 1).date()
+    cutoff_date = today + timedelta(days=days)
+    schedule_refresh()
+
+    rows = AvailableUnitSummaryModel.query.filter(
+        AvailableUnitSummaryModel.expiry_date >= today,
+        AvailableUnitSummaryModel.expiry_date <= cutoff_date
+    ).order_by(AvailableUnitSummaryModel.expiry_date).all()
+
+    units = []
+    for row in rows:
+        unit = row.to_dict()
+        unit["days_remaining"] = (row.expiry_date - today).days
+        units.append(unit)
+    return units
+
+
+#donors who haven't donated in the last 60 days or never did (view_eligible_donors)
+def get_eligible_donors_summary():
+    today = datetime(2025, 12, 1).date()
+    cutoff_date = today - timedelta(days=60)
+    schedule_refresh()
+
+    rows = DonorEligibilitySummaryModel.query.filter(
+        (DonorEligibilitySummaryModel.last_donated_date <= cutoff_date) |
+        (DonorEligibilitySummaryModel.last_donated_date == None)
+    ).all()
 
+    donors = []
+    for row in rows:
+        donor = row.to_dict()
+        if row.last_donated_date is None:
+            donor["last_donation_info"] = "Never Donated"
+            donor["days_since_donation"] = 999
+        else:
+            days = (today - row.last_donated_date).days
+            donor["last_donation_info"] = f"{days} days ago"
+            donor["days_since_donation"] = days
+        donors.append(donor)
+    return donors
 
 
+#available units, expiry range and stock level per blood type (view_inventory_summary)
+def get_inventory_summary():
+    schedule_refresh()
+    rows = {row.blood_type: row for row in InventorySummaryModel.query.all()}
 
+    summary = []
+    for blood_type in ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]:
+        row = rows.get(blood_type)
+        info = row.to_dict() if row else {
+            "blood_type": blood_type, "available_units": 0,
+            "earliest_expiry": None, "latest_expiry": None
+        }
+        count = info["available_units"]
+        if count < 5:
+            info["stock_status"] = "Low"
+        elif count < 10:
+            info["stock_status"] = "On baseline"
+        else:
+            info["stock_status"] = "Surplus"
+        summary.append(info)
+    return summary
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request
+from flask_restful.utils import unpack
+from sites import current_site
+
+#----------------------------------idempotency keys-----------------------------------#
+#a POST sent with an Idempotency-Key header runs once: retries with the same key get the
+#stored response back (with Idempotent-Replayed: true) instead of creating a duplicate.
+#the store is in memory, bounded (oldest keys are evicted first) and keys expire after ttl seconds.
+#bodies are kept as json and capped at max_bytes in total: past that the oldest bodies are
+#dropped, their keys still block duplicates but a retry only gets a short message back
+
+
+class IdempotencyStore:
+    def __init__(self, max_keys=10000, ttl=24 * 60 * 60, max_bytes=16 * 1024 * 1024):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bodies = OrderedDict()  #keys that still have a body -> its size, oldest first
+        self._bytes = 0
+        self._counters = {"stored": 0, "replayed": 0, "conflicts": 0, "evicted": 0, "trimmed": 0}
+
+    #claims the key, returns ("new", None), ("replay", response), ("busy", None) or ("mismatch", None)
+    def begin(self, key, fingerprint):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry["created"] > self.ttl:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self._entries[key] = {"created": now, "fingerprint": fingerprint, "response": None}
+                self._evict()
+                return "new", None
+
+            if entry["fingerprint"] != fingerprint:
+                self._counters["conflicts"] += 1
+                return "mismatch", None
+            if entry["response"] is None:
+                self._counters["conflicts"] += 1
+                return "busy", None
+            self._counters["replayed"] += 1
+            body, code, headers = entry["response"]
+            if body is None:
+                data = {"message": "Request was already processed, its response is no longer stored"}
+            else:
+                data = json.loads(body)
+            return "replay", (data, code, headers)
+
+    def finish(self, key, response):
+        data, code, headers = response
+        body = json.dumps(data, default=str)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["response"] = (body, code, headers)
+                self._bodies[key] = len(body)
+                self._bytes += len(body)
+                self._counters["stored"] += 1
+                self._trim()
+
+    #forgets a key whose request failed so the client can retry it
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["response"] is None:
+                del self._entries[key]
+
+    def _remove(self, key):
+        del self._entries[key]
+        self._bytes -= self._bodies.pop(key, 0)
+
+    def _evict(self):
+        while len(self._entries) > self.max_keys:
+            self._remove(next(iter(self._entries)))
+            self._counters["evicted"] += 1
+
+    #drops the oldest bodies until the rest fit in max_bytes
+    def _trim(self):
+        while self._bytes > self.max_bytes:
+            key, size = self._bodies.popitem(last=False)
+            body, code, headers = self._entries[key]["response"]
+            self._entries[key]["response"] = (None, code, headers)
+            self._bytes -= size
+            self._counters["trimmed"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["keys"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        return stats
+
+
+store = IdempotencyStore()
+
+
+#resource method decorator for POST handlers
+def idempotent(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return fn(*args, **kwargs)
+
+        scoped_key = (current_site(), request.path, key)
+        fingerprint = hashlib.sha256(request.query_string + b"\0" + request.get_data()).hexdigest()
+
+        state, response = store.begin(scoped_key, fingerprint)
+        if state == "mismatch":
+            return {"message": "Idempotency-Key was already used with a different request"}, 422
+        if state == "busy":
+            return {"message": "A request with this Idempotency-Key is still in progress"}, 409
+        if state == "replay":
+            data, code, headers = response
+            return data, code, dict(headers, **{"Idempotent-Replayed": "true"})
+
+        try:
+            data, code, headers = unpack(fn(*args, **kwargs))
+        except Exception:
+            store.release(scoped_key)
+            raise
+
+        #only successful responses are kept, errors can be retried with the same key
+        if code < 400:
+            store.finish(scoped_key, (data, code, headers))
+        else:
+            store.release(scoped_key)
+        return data, code, headers
+    return wrapper
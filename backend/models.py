@@ -1,8 +1,9 @@
-from database import db
-from sqlalchemy import Integer, String, Date, Enum
+from database import db, SITE_PARTITIONED
+from sqlalchemy import Integer, String, Date, DateTime, Enum, func
 
 class DonorModel(db.Model):
     __tablename__ = 'donors'
+    __table_args__ = SITE_PARTITIONED
     
     donor_id = db.Column(Integer, primary_key=True)
     first_name = db.Column(String(50))
@@ -11,6 +12,8 @@ class DonorModel(db.Model):
     phone_num = db.Column(String(20))
     last_donated_date = db.Column(Date)
     drive_id = db.Column(String(50))
+    site_id = db.Column(String(20), nullable=True)
+    updated_at = db.Column(DateTime, server_default=func.now(), onupdate=func.now(), index=True)
     
     def to_dict(self):
         return {
@@ -20,7 +23,8 @@ class DonorModel(db.Model):
             'blood_type': self.blood_type,
             'phone_num': self.phone_num,
             'last_donated_date': str(self.last_donated_date) if self.last_donated_date else None,
-            'drive_id': self.drive_id
+            'drive_id': self.drive_id,
+            'site_id': self.site_id
         }
 
 class HospitalModel(db.Model):
@@ -39,12 +43,19 @@ class HospitalModel(db.Model):
 
 class BloodUnitInfoModel(db.Model):
     __tablename__ = 'bloodunit_info'
+    __table_args__ = SITE_PARTITIONED
     
     unit_id = db.Column(Integer, primary_key=True)
     donor_id = db.Column(Integer)
     donation_date = db.Column(Date)
     expiry_date = db.Column(Date)
     unit_status = db.Column(String(20))
+    site_id = db.Column(String(20), nullable=True)
+    version = db.Column(Integer, nullable=False, default=1, server_default="1")
+    updated_at = db.Column(DateTime, server_default=func.now(), onupdate=func.now(), index=True)
+
+    #optimistic concurrency: every update checks and bumps the row version
+    __mapper_args__ = {"version_id_col": version}
     
     def to_dict(self):
         return {
@@ -52,11 +63,14 @@ class BloodUnitInfoModel(db.Model):
             'donor_id': self.donor_id,
             'donation_date': str(self.donation_date) if self.donation_date else None,
             'expiry_date': str(self.expiry_date) if self.expiry_date else None,
-            'unit_status': self.unit_status
+            'unit_status': self.unit_status,
+            'site_id': self.site_id,
+            'version': self.version
         }
 
 class RequestModel(db.Model):
     __tablename__ = 'requests'
+    __table_args__ = SITE_PARTITIONED
     
     request_id = db.Column(Integer, primary_key=True)
     hospital_id = db.Column(Integer)
@@ -64,6 +78,11 @@ class RequestModel(db.Model):
     request_date = db.Column(Date)
     req_status = db.Column(String(20))
     completed_date = db.Column(Date, nullable=True)
+    site_id = db.Column(String(20), nullable=True)
+    version = db.Column(Integer, nullable=False, default=1, server_default="1")
+
+    #optimistic concurrency: every update checks and bumps the row version
+    __mapper_args__ = {"version_id_col": version}
     
     def to_dict(self):
         return {
@@ -72,7 +91,9 @@ class RequestModel(db.Model):
             'unit_id': self.unit_id,
             'request_date': str(self.request_date) if self.request_date else None,
             'req_status': self.req_status,
-            'completed_date': self.completed_date
+            'completed_date': self.completed_date,
+            'site_id': self.site_id,
+            'version': self.version
         }
     
 class BloodDriveModel(db.Model):
@@ -96,6 +117,82 @@ class BloodDriveModel(db.Model):
             'phone_num': self.phone_num,
             'last_drive_date': self.last_drive_date
         }
-    
-    
 
+
+#------------------------------summary tables------------------------------#
+#maintained by summaries.py from the tables above, they replace the sql views
+
+#available units with their donor's details (replaces view_expiring_units)
+class AvailableUnitSummaryModel(db.Model):
+    __tablename__ = 'summary_available_units'
+
+    unit_id = db.Column(Integer, primary_key=True)
+    donor_id = db.Column(Integer, index=True)
+    blood_type = db.Column(String(5))
+    donor_first_name = db.Column(String(50))
+    donor_last_name = db.Column(String(50))
+    expiry_date = db.Column(Date, index=True)
+
+    __table_args__ = (
+        db.Index('ix_summary_available_units_type_expiry', 'blood_type', 'expiry_date'),
+        SITE_PARTITIONED
+    )
+
+    def to_dict(self):
+        return {
+            'unit_id': self.unit_id,
+            'donor_id': self.donor_id,
+            'blood_type': self.blood_type,
+            'donor_first_name': self.donor_first_name,
+            'donor_last_name': self.donor_last_name,
+            'expiry_date': str(self.expiry_date) if self.expiry_date else None,
+            'unit_status': 'Available'
+        }
+
+#donors indexed by last donation date (replaces view_eligible_donors)
+class DonorEligibilitySummaryModel(db.Model):
+    __tablename__ = 'summary_donor_eligibility'
+    __table_args__ = SITE_PARTITIONED
+
+    donor_id = db.Column(Integer, primary_key=True)
+    first_name = db.Column(String(50))
+    last_name = db.Column(String(50))
+    blood_type = db.Column(String(5))
+    phone_num = db.Column(String(20))
+    last_donated_date = db.Column(Date, index=True)
+
+    def to_dict(self):
+        return {
+            'donor_id': self.donor_id,
+            'first_name': self.first_name,
+            'last_name': self.last_name,
+            'blood_type': self.blood_type,
+            'phone_num': self.phone_num,
+            'last_donated_date': str(self.last_donated_date) if self.last_donated_date else None
+        }
+
+#available unit count and expiry range per blood type (replaces view_inventory_summary)
+class InventorySummaryModel(db.Model):
+    __tablename__ = 'summary_inventory'
+    __table_args__ = SITE_PARTITIONED
+
+    blood_type = db.Column(String(5), primary_key=True)
+    available_units = db.Column(Integer, nullable=False, default=0)
+    earliest_expiry = db.Column(Date, nullable=True)
+    latest_expiry = db.Column(Date, nullable=True)
+
+    def to_dict(self):
+        return {
+            'blood_type': self.blood_type,
+            'available_units': self.available_units,
+            'earliest_expiry': str(self.earliest_expiry) if self.earliest_expiry else None,
+            'latest_expiry': str(self.latest_expiry) if self.latest_expiry else None
+        }
+
+#how far each source table has been folded into the summaries (by updated_at)
+class SummaryRefreshModel(db.Model):
+    __tablename__ = 'summary_refresh'
+    __table_args__ = SITE_PARTITIONED
+
+    source = db.Column(String(20), primary_key=True)
+    refreshed_through = db.Column(DateTime, nullable=True)
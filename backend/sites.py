@@ -0,0 +1,100 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, g, request
+from database import db
+
+#----------------------------------site shards-----------------------------------#
+#each collection center (site) lives in its own database with the same schema.
+#shards are configured with SITE_SHARDS, a comma separated list of site=uri pairs:
+#   SITE_SHARDS=north=sqlite:///north.db,south=sqlite:///south.db
+#a request selects its site with the X-Site header or the ?site= query arg,
+#requests without a site keep using the default database
+
+
+#parses SITE_SHARDS into {site: uri}
+def load_site_shards(value=None):
+    value = os.getenv("SITE_SHARDS", "") if value is None else value
+    shards = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        site, _, uri = entry.partition("=")
+        if not uri:
+            raise ValueError(f"Invalid SITE_SHARDS entry: {entry}")
+        shards[site.strip()] = uri.strip()
+    return shards
+
+
+#registers the shards as flask-sqlalchemy binds, must run before db.init_app
+def configure_sites(app, shards=None):
+    shards = load_site_shards() if shards is None else shards
+    binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+    binds.update(shards)
+    app.config["SITES"] = list(shards)
+
+
+def get_sites():
+    return current_app.config.get("SITES", [])
+
+
+#creates the site partitioned tables on every shard (used to set up local sqlite shards),
+#shared tables like hospitals only exist on the default database
+def create_site_tables():
+    import models  #registers the tables on db.metadata
+    tables = [table for table in db.metadata.sorted_tables if table.info.get("site_partitioned")]
+    for site in get_sites():
+        db.metadata.create_all(db.engines[site], tables=tables)
+
+
+#before_request hook: picks the site for this request, answers 400 for unknown sites
+def select_site():
+    site = request.headers.get("X-Site") or request.args.get("site")
+    if site is None:
+        g.site = None
+        return None
+    if site not in get_sites():
+        return {"message": f"Unknown site: {site}"}, 400
+    g.site = site
+    return None
+
+
+def current_site():
+    return g.get("site")
+
+
+#runs fn(*args) once per site in parallel, each in its own app context bound to that site
+#returns {site: result}
+def fan_out(fn, *args, sites=None, **kwargs):
+    app = current_app._get_current_object()
+    sites = get_sites() if sites is None else sites
+
+    def run(site):
+        with app.app_context():
+            g.site = site
+            return fn(*args, **kwargs)
+
+    if not sites:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(sites)) as pool:
+        results = pool.map(run, sites)
+        return dict(zip(sites, results))
+
+
+#runs fn(*args) in a daemon thread with its own app context bound to the current site,
+#for refresh work that shouldn't hold up the request that triggered it. errors are logged
+def run_in_background(fn, *args, **kwargs):
+    app = current_app._get_current_object()
+    site = current_site()
+
+    def run():
+        with app.app_context():
+            g.site = site
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                app.logger.exception("background job %s failed (site %s)", fn.__name__, site)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,270 @@
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from flask import current_app
+from sqlalchemy import event, delete, select, update, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+from database import db, SiteSession, settled_until, changed_between
+from models import (
+    BloodUnitInfoModel,
+    DonorModel,
+    AvailableUnitSummaryModel,
+    DonorEligibilitySummaryModel,
+    InventorySummaryModel,
+    SummaryRefreshModel
+)
+from sites import current_site, run_in_background
+
+#----------------------------------summary tables-----------------------------------#
+#the summary tables replace the sql views (view_expiring_units, view_eligible_donors,
+#view_inventory_summary) with plain indexed tables, so reads never re-run the joins.
+#
+#inserts/updates are folded in by refresh_summaries(), which only reads the units and donors
+#whose updated_at moved since the last refresh. it runs from cli.py or in the background
+#(schedule_refresh), never inside a read. the unit counts in summary_inventory are kept up
+#to date with +/- deltas. deletes are applied right away by a flush listener because a
+#deleted row leaves no timestamp behind.
+
+#a refresh only reads up to this far behind the database clock, see database.settled_until
+REFRESH_SETTLE = timedelta(seconds=2)
+
+SOURCES = ["donors", "units"]
+
+_INSERTS = {"mysql": mysql.insert, "postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+#rows per upsert statement and ids per IN list (keeps a full rebuild under the bound parameter limits)
+UPSERT_BATCH = 500
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), UPSERT_BATCH):
+        yield ids[start:start + UPSERT_BATCH]
+
+
+#insert ... on duplicate key update (mysql) / on conflict do update (sqlite, postgresql),
+#with update=False rows that already exist are left alone. the `increment` columns are added
+#to the existing value instead of replacing it
+def _upsert(session, model, rows, update=True, increment=()):
+    if not rows:
+        return
+    table = model.__table__
+    dialect = session.get_bind(mapper=model).dialect.name
+    if dialect not in _INSERTS:
+        raise NotImplementedError(f"summary tables don't support {dialect}")
+
+    for start in range(0, len(rows), UPSERT_BATCH):
+        session.execute(_upsert_statement(dialect, table, rows[start:start + UPSERT_BATCH], update, increment))
+
+
+def _upsert_statement(dialect, table, rows, update, increment):
+    keys = [column.name for column in table.primary_key.columns]
+    stmt = _INSERTS[dialect](table).values(rows)
+    if dialect == "mysql":
+        values = stmt.inserted if update else table.c
+        columns = [column.name for column in table.columns if update and not column.primary_key] or keys
+        stmt = stmt.on_duplicate_key_update({
+            name: table.c[name] + values[name] if name in increment else values[name] for name in columns
+        })
+    elif update:
+        columns = [column.name for column in table.columns if not column.primary_key]
+        stmt = stmt.on_conflict_do_update(index_elements=keys, set_={
+            name: table.c[name] + stmt.excluded[name] if name in increment else stmt.excluded[name]
+            for name in columns
+        })
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+    return stmt
+
+
+#locks the refresh state rows so two refreshes (workers, cli.py) never fold in the same
+#changes twice. with wait=False a refresh that finds them locked is skipped (returns None)
+def _lock_state(session, wait):
+    query = select(SummaryRefreshModel).where(SummaryRefreshModel.source.in_(SOURCES))
+    if len(session.execute(query).all()) < len(SOURCES):
+        _upsert(session, SummaryRefreshModel, [{"source": source} for source in SOURCES], update=False)
+    if session.get_bind(mapper=SummaryRefreshModel).dialect.name == "sqlite":
+        #no row locks (FOR UPDATE is dropped), a no-op update takes the database write lock instead
+        session.execute(
+            update(SummaryRefreshModel).values(source=SummaryRefreshModel.source)
+            .execution_options(synchronize_session=False)
+        )
+    rows = session.execute(query.with_for_update(skip_locked=not wait)).scalars().all()
+    if len(rows) < len(SOURCES):
+        return None
+    return {state.source: state for state in rows}
+
+
+#moves the min/max expiry of the given blood types and adds their unit count deltas.
+#both ends are single seeks on ix_summary_available_units_type_expiry
+def _apply_inventory(session, deltas):
+    rows = []
+    for blood_type, delta in deltas.items():
+        if blood_type is None:
+            continue
+        expiry = AvailableUnitSummaryModel.expiry_date
+        where = AvailableUnitSummaryModel.blood_type == blood_type
+        rows.append({
+            "blood_type": blood_type, "available_units": delta,
+            "earliest_expiry": session.execute(select(func.min(expiry)).where(where)).scalar(),
+            "latest_expiry": session.execute(select(func.max(expiry)).where(where)).scalar()
+        })
+    _upsert(session, InventorySummaryModel, rows, increment=("available_units",))
+
+
+#subtracts the summary rows matching `ids` from their blood type's count
+def _count_out(session, deltas, column, ids):
+    for chunk in _chunks(ids):
+        for blood_type, count in session.execute(
+            select(AvailableUnitSummaryModel.blood_type, func.count())
+            .where(column.in_(chunk))
+            .group_by(AvailableUnitSummaryModel.blood_type)
+        ):
+            deltas[blood_type] -= count
+
+
+#folds changed units and donors into the summary tables, full=True rebuilds them from scratch.
+#runs in its own session and transaction on the current site's database, so it never
+#commits (or sees) the caller's pending changes. returns None when wait=False and another
+#refresh holds the lock
+def refresh_summaries(full=False, wait=True):
+    session = Session(bind=db.session.get_bind(mapper=SummaryRefreshModel))
+    try:
+        result = _refresh(session, full, wait)
+        session.commit()
+        return result
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _refresh(session, full, wait):
+    state = _lock_state(session, wait)
+    if state is None:
+        return None
+    since = [state[source].refreshed_through for source in SOURCES]
+    since = None if full or None in since else min(since)
+    full = since is None
+    until = settled_until(session, SummaryRefreshModel, REFRESH_SETTLE)
+
+    deltas = Counter()
+    if full:
+        session.execute(delete(AvailableUnitSummaryModel))
+        session.execute(delete(DonorEligibilitySummaryModel))
+        session.execute(delete(InventorySummaryModel))
+
+    #donors: eligibility rows, and the donor details copied onto their available units
+    donors = changed_between(session.query(DonorModel), DonorModel.updated_at, since, until).all()
+    _upsert(session, DonorEligibilitySummaryModel, [{
+        "donor_id": donor.donor_id,
+        "first_name": donor.first_name,
+        "last_name": donor.last_name,
+        "blood_type": donor.blood_type,
+        "phone_num": donor.phone_num,
+        "last_donated_date": donor.last_donated_date
+    } for donor in donors])
+
+    #a full rebuild has no unit rows yet, otherwise only donors that have some are updated
+    by_id = {donor.donor_id: donor for donor in donors}
+    with_units = set()
+    for chunk in ([] if full else _chunks(by_id)):
+        for donor_id, blood_type, count in session.execute(
+            select(AvailableUnitSummaryModel.donor_id, AvailableUnitSummaryModel.blood_type, func.count())
+            .where(AvailableUnitSummaryModel.donor_id.in_(chunk))
+            .group_by(AvailableUnitSummaryModel.donor_id, AvailableUnitSummaryModel.blood_type)
+        ):
+            with_units.add(donor_id)
+            if blood_type != by_id[donor_id].blood_type:
+                deltas[blood_type] -= count
+                deltas[by_id[donor_id].blood_type] += count
+    for donor_id in with_units:
+        donor = by_id[donor_id]
+        session.execute(
+            update(AvailableUnitSummaryModel)
+            .where(AvailableUnitSummaryModel.donor_id == donor_id)
+            .values(
+                blood_type=donor.blood_type,
+                donor_first_name=donor.first_name,
+                donor_last_name=donor.last_name
+            )
+        )
+
+    #units: an available unit with a donor has a row, anything else has none.
+    #their previous rows are counted out and the current ones counted back in
+    rows = changed_between(
+        session.query(
+            BloodUnitInfoModel.unit_id, BloodUnitInfoModel.unit_status, BloodUnitInfoModel.expiry_date,
+            DonorModel.donor_id, DonorModel.blood_type, DonorModel.first_name, DonorModel.last_name
+        ).outerjoin(DonorModel, BloodUnitInfoModel.donor_id == DonorModel.donor_id),
+        BloodUnitInfoModel.updated_at, since, until
+    ).all()
+    available = [row for row in rows if row.unit_status == "Available" and row.donor_id is not None]
+    if not full:
+        unit_ids = [row.unit_id for row in rows]
+        _count_out(session, deltas, AvailableUnitSummaryModel.unit_id, unit_ids)
+        removed = set(unit_ids).difference(row.unit_id for row in available)
+        for chunk in _chunks(removed):
+            session.execute(delete(AvailableUnitSummaryModel).where(AvailableUnitSummaryModel.unit_id.in_(chunk)))
+    _upsert(session, AvailableUnitSummaryModel, [{
+        "unit_id": row.unit_id,
+        "donor_id": row.donor_id,
+        "blood_type": row.blood_type,
+        "donor_first_name": row.first_name,
+        "donor_last_name": row.last_name,
+        "expiry_date": row.expiry_date
+    } for row in available])
+    deltas.update(row.blood_type for row in available)
+
+    _apply_inventory(session, deltas)
+
+    #nothing new leaves the state rows (and the write) alone, the next window starts earlier
+    if full or donors or rows:
+        for source in SOURCES:
+            state[source].refreshed_through = until
+    return {"donors": len(donors), "units": len(rows), "blood_types": sorted(t for t in deltas if t)}
+
+
+#----------------------------------background refresh-----------------------------------#
+#reads call schedule_refresh(), which starts a refresh in a background thread at most once
+#every SUMMARY_REFRESH_SECONDS per site (0 turns it off, e.g. when cli.py runs it on a timer)
+
+_scheduled = {}
+_schedule_lock = threading.Lock()
+
+
+def schedule_refresh():
+    interval = current_app.config["SUMMARY_REFRESH_SECONDS"]
+    if not interval:
+        return None
+    site = current_site()
+    now = time.monotonic()
+    with _schedule_lock:
+        last = _scheduled.get(site)
+        if last is not None and now - last < interval:
+            return None
+        _scheduled[site] = now
+    return run_in_background(refresh_summaries, wait=False)
+
+
+#deleted units and donors are removed from the summaries in the same transaction
+@event.listens_for(SiteSession, "after_flush")
+def _apply_deletes(session, flush_context):
+    unit_ids = [obj.unit_id for obj in session.deleted if isinstance(obj, BloodUnitInfoModel)]
+    donor_ids = [obj.donor_id for obj in session.deleted if isinstance(obj, DonorModel)]
+    if not unit_ids and not donor_ids:
+        return
+
+    deltas = Counter()
+    _count_out(session, deltas, AvailableUnitSummaryModel.unit_id, unit_ids)
+    for chunk in _chunks(unit_ids):
+        session.execute(delete(AvailableUnitSummaryModel).where(AvailableUnitSummaryModel.unit_id.in_(chunk)))
+    #their units lose the donor (ON DELETE SET NULL), the views' inner join dropped them too
+    _count_out(session, deltas, AvailableUnitSummaryModel.donor_id, donor_ids)
+    for chunk in _chunks(donor_ids):
+        session.execute(delete(AvailableUnitSummaryModel).where(AvailableUnitSummaryModel.donor_id.in_(chunk)))
+        session.execute(delete(DonorEligibilitySummaryModel).where(DonorEligibilitySummaryModel.donor_id.in_(chunk)))
+    _apply_inventory(session, deltas)
@@ -0,0 +1,85 @@
+import os
+import sys
+
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db
+import analytics
+import idempotency
+import summaries
+import throttle
+
+BLOOD_TYPES = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
+
+
+#builds an app on a fresh sqlite database, extra config (e.g. rate limits) is passed through
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'main.db'}")
+    monkeypatch.setenv("SITE_SHARDS", "")
+    monkeypatch.delenv("ANALYTICS_ENGINE", raising=False)
+    monkeypatch.delenv("TRUSTED_PROXIES", raising=False)
+
+    #module level state is shared by every app in the process
+    throttle.limiter = throttle.TokenBucketLimiter()
+    idempotency.store = idempotency.IdempotencyStore()
+    analytics.disable_analytics()
+    summaries._scheduled.clear()
+
+    def make(**config):
+        from factory import create_app
+        import models  #registers the tables on db.metadata
+        settings = {
+            "TESTING": True, "RATE_LIMIT_RATE": 1000, "RATE_LIMIT_CAPACITY": 1000,
+            "ANALYTICS_SYNC_SECONDS": 0, "SUMMARY_REFRESH_SECONDS": 0
+        }
+        settings.update(config)
+        app = create_app(config=settings)
+        with app.app_context():
+            db.create_all(bind_key=None)
+        return app
+
+    yield make
+    analytics.disable_analytics()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+#a few donors of each blood type with units in every status, expiring around the system date
+#(December 1st, 2025), plus a unit without a donor
+@pytest.fixture
+def seeded(app):
+    from models import DonorModel, BloodUnitInfoModel
+    statuses = ["Available", "Available", "Reserved", "Issued", "Expired", "Discarded"]
+    with app.app_context():
+        for i in range(24):
+            last_donated = None if i % 5 == 0 else date(2025, 1 + i % 11, 1 + i % 28)
+            donor = DonorModel(
+                first_name=f"first{i}", last_name=f"last{i}", blood_type=BLOOD_TYPES[i % 8],
+                phone_num=str(i), last_donated_date=last_donated
+            )
+            db.session.add(donor)
+            db.session.flush()
+            for j in range(3):
+                db.session.add(BloodUnitInfoModel(
+                    donor_id=donor.donor_id, donation_date=date(2025, 10, 1),
+                    expiry_date=date(2025, 11, 20) + timedelta(days=(i + 7 * j) % 30),
+                    unit_status=statuses[(i + j) % len(statuses)]
+                ))
+        db.session.add(BloodUnitInfoModel(
+            donor_id=None, donation_date=date(2025, 11, 1), expiry_date=date(2025, 12, 5), unit_status="Available"
+        ))
+        db.session.commit()
+    return app
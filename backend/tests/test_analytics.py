@@ -0,0 +1,126 @@
+import time
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import analytics
+import functions
+from database import db
+from models import BloodUnitInfoModel, DonorModel
+
+
+def ids(rows, column):
+    return sorted(getattr(row, column) for row in rows)
+
+
+#the engine backed functions and their plain sql versions
+def results():
+    return {
+        "summary": functions.get_summary(),
+        "inventory": functions.get_inventory_by_blood_type(),
+        "low_stock": functions.get_low_stock(amount=5),
+        "expiring": ids(functions.get_expiring_units(days=20), "unit_id"),
+        "expiring_1": ids(functions.get_expiring_units(days=1), "unit_id"),
+        "expired": ids(functions.get_expired_units(), "unit_id"),
+        "eligible": ids(functions.get_eligible_donors(), "donor_id")
+    }
+
+
+def sql_results(monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(functions, "get_engine", lambda: None)
+        return results()
+
+
+@pytest.fixture
+def engine_app(seeded):
+    seeded.config["ANALYTICS_SYNC_SECONDS"] = 0
+    analytics.enable_analytics()
+    return seeded
+
+
+def test_engine_matches_sql(engine_app, monkeypatch):
+    with engine_app.app_context():
+        assert analytics.get_engine() is not None
+        expected = sql_results(monkeypatch)
+        assert expected["expiring"] and expected["expired"] and expected["eligible"]
+        assert results() == expected
+
+
+def test_engine_follows_writes_in_this_process(engine_app, monkeypatch):
+    with engine_app.app_context():
+        analytics.get_engine()
+        unit = BloodUnitInfoModel.query.filter_by(unit_status="Reserved").first()
+        unit.unit_status = "Available"
+        unit.expiry_date = date(2025, 12, 3)
+        donor = DonorModel.query.first()
+        donor.blood_type = "O-"
+        db.session.delete(BloodUnitInfoModel.query.filter_by(unit_status="Issued").first())
+        db.session.commit()
+        assert results() == sql_results(monkeypatch)
+
+
+#another worker or cli.py: nothing in this process sees the commit
+def run_elsewhere(app, *statements):
+    other = create_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+    with other.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+    other.dispose()
+
+
+def test_engine_picks_up_writes_from_other_processes(engine_app, monkeypatch):
+    monkeypatch.setattr(analytics, "SYNC_SETTLE", timedelta(seconds=1))
+    with engine_app.app_context():
+        engine = analytics.get_engine()
+        assert functions.get_summary()["available_units"] > 0
+        run_elsewhere(engine_app,
+            "UPDATE bloodunit_info SET unit_status = 'Expired', updated_at = CURRENT_TIMESTAMP "
+            "WHERE unit_status = 'Available'"
+        )
+        #the update is only read once its second has settled
+        time.sleep(2.1)
+        assert engine.sync(db.session)["reloaded"] is False
+        assert functions.get_summary()["available_units"] == 0
+        assert results() == sql_results(monkeypatch)
+
+        #the watermark moved past the rows it applied
+        assert engine.sync(db.session) == {"donors": 0, "units": 0, "reloaded": False}
+
+
+def test_engine_catches_deletes_from_other_processes(engine_app, monkeypatch):
+    with engine_app.app_context():
+        engine = analytics.get_engine()
+        #deleted rows leave no updated_at behind and the insert keeps the row count unchanged,
+        #the sum of the ids still differs
+        run_elsewhere(engine_app,
+            "DELETE FROM bloodunit_info WHERE unit_id = (SELECT MIN(unit_id) FROM bloodunit_info)",
+            "INSERT INTO bloodunit_info (donor_id, donation_date, expiry_date, unit_status, version) "
+            "VALUES (2, '2025-11-01', '2025-12-04', 'Available', 1)",
+            "DELETE FROM donors WHERE donor_id = 1"
+        )
+        assert engine.sync(db.session)["reloaded"] is True
+        assert results() == sql_results(monkeypatch)
+
+
+def test_engine_syncs_in_the_background(engine_app, monkeypatch):
+    monkeypatch.setattr(analytics, "SYNC_SETTLE", timedelta(seconds=1))
+    engine_app.config["ANALYTICS_SYNC_SECONDS"] = 60
+    with engine_app.app_context():
+        engine = analytics.get_engine()
+        run_elsewhere(engine_app,
+            "UPDATE bloodunit_info SET unit_status = 'Discarded', updated_at = CURRENT_TIMESTAMP "
+            "WHERE unit_status = 'Reserved'"
+        )
+        time.sleep(2.1)
+        engine.synced = None  #due now
+        assert analytics.get_engine() is engine
+        engine.sync_thread.join(timeout=10)
+        assert engine.count_units("Reserved") == 0
+        assert results() == sql_results(monkeypatch)
+
+        #not due again for another minute
+        thread = engine.sync_thread
+        analytics.get_engine()
+        assert engine.sync_thread is thread
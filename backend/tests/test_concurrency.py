@@ -0,0 +1,112 @@
+import threading
+from collections import Counter
+from datetime import date
+
+import pytest
+from sqlalchemy import event, text
+
+from database import db, SiteSession
+from models import BloodUnitInfoModel, DonorModel, HospitalModel, RequestModel
+
+THREADS = 16
+
+
+@pytest.fixture
+def units_app(app):
+    with app.app_context():
+        db.session.add(HospitalModel(hospital_name="General", address="1 Main St"))
+        donor = DonorModel(first_name="a", last_name="b", blood_type="O-")
+        db.session.add(donor)
+        db.session.flush()
+        for i in range(5):
+            db.session.add(BloodUnitInfoModel(donor_id=donor.donor_id, donation_date=date(2025, 11, 1),
+                                              expiry_date=date(2025, 12, 20), unit_status="Available"))
+        db.session.commit()
+    return app
+
+
+#runs call(client) from THREADS threads released at the same time, returns the status codes
+def race(app, call):
+    codes = Counter()
+    barrier = threading.Barrier(THREADS)
+
+    def worker():
+        client = app.test_client()
+        barrier.wait()
+        codes[call(client).status_code] += 1
+
+    threads = [threading.Thread(target=worker) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return codes
+
+
+def request_body(unit_id, status="Pending"):
+    return {"hospital_id": 1, "unit_id": unit_id, "request_date": "2025-12-01", "req_status": status}
+
+
+def test_one_request_wins_a_unit(units_app):
+    for unit_id in range(1, 4):
+        codes = race(units_app, lambda c: c.post("/api/requests/", json=request_body(unit_id)))
+        assert codes == {201: 1, 409: THREADS - 1}
+    with units_app.app_context():
+        assert RequestModel.query.count() == 3
+        assert BloodUnitInfoModel.query.filter_by(unit_status="Reserved").count() == 3
+
+
+def test_retries_with_the_same_key_create_one_request(units_app):
+    headers = {"Idempotency-Key": "retry-1"}
+    codes = race(units_app, lambda c: c.post("/api/requests/", json=request_body(4), headers=headers))
+    assert codes[201] >= 1 and set(codes) <= {201, 409}
+
+    client = units_app.test_client()
+    retry = client.post("/api/requests/", json=request_body(4), headers=headers)
+    assert retry.status_code == 201 and retry.headers["Idempotent-Replayed"] == "true"
+    assert client.post("/api/requests/", json=request_body(5), headers=headers).status_code == 422
+    with units_app.app_context():
+        assert RequestModel.query.count() == 1
+
+
+def test_if_match_lets_one_edit_through(units_app):
+    client = units_app.test_client()
+    tag = client.get("/api/bloodunits/1").headers["ETag"]
+    body = {"donation_date": "2025-11-01", "expiry_date": "2025-12-20", "unit_status": "Issued"}
+    codes = race(units_app, lambda c: c.patch("/api/bloodunits/1", json=body, headers={"If-Match": tag}))
+    assert codes[200] == 1 and set(codes) <= {200, 409, 412}
+    assert client.patch("/api/bloodunits/1", json=body, headers={"If-Match": tag}).status_code == 412
+
+
+def test_closing_a_request_releases_or_issues_its_unit(units_app):
+    client = units_app.test_client()
+    client.post("/api/requests/", json=request_body(1))
+    client.post("/api/requests/", json=request_body(2))
+
+    assert client.patch("/api/requests/1", json=request_body(1, "Cancelled")).status_code == 200
+    assert client.patch("/api/requests/2", json=request_body(2, "Completed")).status_code == 200
+    with units_app.app_context():
+        assert db.session.get(BloodUnitInfoModel, 1).unit_status == "Available"
+        assert db.session.get(BloodUnitInfoModel, 2).unit_status == "Issued"
+
+    #the released unit can be requested again, reopening the cancelled request now conflicts
+    assert client.post("/api/requests/", json=request_body(1)).status_code == 201
+    assert client.patch("/api/requests/1", json=request_body(1, "Pending")).status_code == 409
+
+
+def test_sweep_that_loses_a_race_is_a_409(units_app):
+    with units_app.app_context():
+        db.session.get(BloodUnitInfoModel, 1).expiry_date = date(2025, 11, 1)
+        db.session.commit()
+        engine = db.engine
+
+    #another writer bumps the unit between the sweep's read and its commit
+    @event.listens_for(SiteSession, "before_flush", once=True)
+    def other_writer(session, flush_context, instances):
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE bloodunit_info SET version = version + 1 WHERE unit_id = 1"))
+
+    response = units_app.test_client().post("/api/function/mark-expired")
+    assert response.status_code == 409
+    with units_app.app_context():
+        assert db.session.get(BloodUnitInfoModel, 1).unit_status == "Available"
@@ -0,0 +1,35 @@
+from idempotency import IdempotencyStore
+
+
+def stored(store, key, data, code=201):
+    assert store.begin(key, "body")[0] == "new"
+    store.finish(key, (data, code, {}))
+
+
+def test_replays_the_stored_response():
+    store = IdempotencyStore()
+    stored(store, "a", {"unit_id": 1, "rows": [{"unit_id": 1}]})
+    assert store.begin("a", "body") == ("replay", ({"unit_id": 1, "rows": [{"unit_id": 1}]}, 201, {}))
+    assert store.begin("a", "other body") == ("mismatch", None)
+
+
+def test_bodies_are_capped_by_total_size():
+    big = {"rows": ["x" * 100]}
+    store = IdempotencyStore(max_bytes=250)
+    for key in "abc":
+        stored(store, key, big)
+
+    #the oldest body was dropped, its key still blocks a duplicate
+    state, (data, code, headers) = store.begin("a", "body")
+    assert state == "replay" and code == 201 and "no longer stored" in data["message"]
+    assert store.begin("c", "body") == ("replay", (big, 201, {}))
+    stats = store.stats()
+    assert stats["trimmed"] == 1 and stats["keys"] == 3 and stats["bytes"] <= 250
+
+
+def test_evicted_keys_give_their_bytes_back():
+    store = IdempotencyStore(max_keys=2)
+    for key in "abc":
+        stored(store, key, {"rows": ["x" * 100]})
+    assert store.stats()["keys"] == 2
+    assert store.stats()["bytes"] == 2 * len('{"rows": ["' + "x" * 100 + '"]}')
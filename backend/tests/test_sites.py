@@ -0,0 +1,54 @@
+from sqlalchemy import text
+
+from database import db
+from models import DonorModel, HospitalModel
+from sites import create_site_tables
+
+
+def make_site_app(make_app, monkeypatch, tmp_path):
+    monkeypatch.setenv("SITE_SHARDS", f"north=sqlite:///{tmp_path / 'north.db'}")
+    app = make_app()
+    with app.app_context():
+        create_site_tables()
+    return app
+
+
+def test_only_partitioned_tables_go_to_the_shard(make_app, monkeypatch, tmp_path):
+    app = make_site_app(make_app, monkeypatch, tmp_path)
+    client = app.test_client()
+    north = {"X-Site": "north"}
+
+    hospital = client.post("/api/hospitals/", json={"hospital_name": "General", "address": "1 Main St"}, headers=north)
+    donor = client.post("/api/donors/", json={
+        "first_name": "a", "last_name": "b", "blood_type": "A+", "phone_num": "1",
+        "last_donated_date": "2025-01-01"
+    }, headers=north)
+    assert hospital.status_code == 201 and donor.status_code == 201
+
+    with app.app_context():
+        assert HospitalModel.query.count() == 1
+        assert DonorModel.query.count() == 0
+        north_tables = db.inspect(db.engines["north"]).get_table_names()
+    assert "donors" in north_tables and "hospitals" not in north_tables
+
+    #the hospital is visible from every site, the donor only from its own
+    assert len(client.get("/api/hospitals/").json) == 1
+    assert len(client.get("/api/donors/", headers=north).json) == 1
+    assert client.get("/api/donors/").json == []
+
+
+#rows loaded with plain sql (e.g. "Data population") don't set the version column
+def test_shard_tables_have_a_version_default(make_app, monkeypatch, tmp_path):
+    app = make_site_app(make_app, monkeypatch, tmp_path)
+    with app.app_context():
+        with db.engines["north"].begin() as conn:
+            conn.execute(text(
+                "INSERT INTO bloodunit_info (unit_id, donor_id, unit_status) VALUES (1, NULL, 'Available')"
+            ))
+            conn.execute(text(
+                "INSERT INTO requests (request_id, hospital_id, unit_id, req_status) VALUES (1, 1, 1, 'Pending')"
+            ))
+            versions = conn.execute(text(
+                "SELECT (SELECT version FROM bloodunit_info), (SELECT version FROM requests)"
+            )).one()
+    assert tuple(versions) == (1, 1)
@@ -0,0 +1,135 @@
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import functions
+import summaries
+from database import db
+from models import BloodUnitInfoModel, DonorModel
+from summaries import refresh_summaries
+
+
+def summary_ids(days=20):
+    return sorted(unit["unit_id"] for unit in functions.get_expiring_units_summary(days=days))
+
+
+#like view_expiring_units, the summary only has units whose donor exists
+def sql_ids(days=20):
+    return sorted(unit.unit_id for unit in functions.get_expiring_units(days=days) if unit.donor_id is not None)
+
+
+def assert_matches_sql():
+    assert summary_ids() == sql_ids()
+    assert sorted(d["donor_id"] for d in functions.get_eligible_donors_summary()) == \
+        sorted(donor.donor_id for donor in functions.get_eligible_donors())
+    inventory = {row["blood_type"]: row["available_units"] for row in functions.get_inventory_summary()}
+    assert inventory == functions.get_inventory_by_blood_type()
+
+
+#the refresh only reads whole seconds that are at least a second old
+@pytest.fixture
+def settle(monkeypatch):
+    monkeypatch.setattr(summaries, "REFRESH_SETTLE", timedelta(seconds=1))
+    return lambda: time.sleep(2.2)
+
+
+def test_summaries_match_sql(seeded):
+    with seeded.app_context():
+        refresh_summaries()
+        assert_matches_sql()
+
+
+def test_incremental_refresh_matches_sql(seeded, settle):
+    with seeded.app_context():
+        refresh_summaries()
+        donor = db.session.get(DonorModel, 2)
+        donor.blood_type = "AB-"
+        db.session.delete(BloodUnitInfoModel.query.filter_by(unit_status="Available").first())
+        unit = BloodUnitInfoModel.query.filter_by(unit_status="Available").order_by(BloodUnitInfoModel.unit_id.desc()).first()
+        unit.expiry_date = date(2025, 12, 2)
+        db.session.add(BloodUnitInfoModel(
+            donor_id=3, donation_date=date(2025, 11, 1), expiry_date=date(2025, 12, 8), unit_status="Available"
+        ))
+        db.session.commit()
+
+        settle()
+        result = refresh_summaries()
+        assert result["donors"] >= 1 and result["units"] >= 2
+        assert_matches_sql()
+        for row in functions.get_inventory_summary():
+            expiry = [
+                unit.expiry_date for unit in BloodUnitInfoModel.query.filter_by(unit_status="Available")
+                if unit.donor_id and db.session.get(DonorModel, unit.donor_id).blood_type == row["blood_type"]
+            ]
+            expected = (str(min(expiry)), str(max(expiry))) if expiry else (None, None)
+            assert (row["earliest_expiry"], row["latest_expiry"]) == expected
+
+        #the watermark moved past everything it read
+        assert refresh_summaries()["units"] == 0
+
+
+#a row flipped back within the same second must still be picked up
+def test_same_second_changes_are_refreshed(seeded, settle):
+    with seeded.app_context():
+        refresh_summaries()
+        first, second = summary_ids()[:2]
+        stamp = datetime.utcnow().replace(microsecond=0)
+
+        unit = db.session.get(BloodUnitInfoModel, first)
+        unit.unit_status = "Reserved"
+        unit.updated_at = stamp
+        db.session.commit()
+        refresh_summaries()
+
+        #same second as the change above, after that refresh ran
+        unit = db.session.get(BloodUnitInfoModel, second)
+        unit.unit_status = "Reserved"
+        unit.updated_at = stamp
+        db.session.commit()
+
+        settle()
+        refresh_summaries()
+        ids = summary_ids()
+        assert first not in ids and second not in ids
+        assert ids == sql_ids()
+
+
+def test_reads_refresh_in_the_background(seeded):
+    seeded.config["SUMMARY_REFRESH_SECONDS"] = 60
+    with seeded.app_context():
+        thread = summaries.schedule_refresh()
+        thread.join(timeout=10)
+        assert summary_ids() == sql_ids()
+        #not due again for another minute
+        assert summaries.schedule_refresh() is None
+
+
+def test_refresh_leaves_the_callers_session_alone(seeded):
+    with seeded.app_context():
+        donors = DonorModel.query.count()
+        db.session.add(DonorModel(first_name="pending", last_name="x", blood_type="A+"))
+        refresh_summaries()
+        db.session.rollback()
+        assert DonorModel.query.count() == donors
+
+
+def test_concurrent_refreshes(seeded):
+    errors = []
+
+    def worker():
+        try:
+            with seeded.app_context():
+                refresh_summaries(full=True)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with seeded.app_context():
+        assert_matches_sql()
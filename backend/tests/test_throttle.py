@@ -0,0 +1,136 @@
+import threading
+import time
+
+import pytest
+
+from throttle import SingleFlight, TokenBucketLimiter
+
+
+def test_forwarded_for_does_not_bypass_the_limit(make_app):
+    client = make_app(RATE_LIMIT_RATE=0.01, RATE_LIMIT_CAPACITY=3).test_client()
+    codes = [
+        client.get("/api/function/inventory", headers={"X-Forwarded-For": f"10.0.0.{i}"}).status_code
+        for i in range(6)
+    ]
+    assert codes == [200, 200, 200, 429, 429, 429]
+
+
+def test_forwarded_for_is_used_behind_a_trusted_proxy(make_app):
+    client = make_app(RATE_LIMIT_RATE=0.01, RATE_LIMIT_CAPACITY=1, TRUSTED_PROXIES=1).test_client()
+    first = client.get("/api/function/inventory", headers={"X-Forwarded-For": "10.0.0.1"})
+    again = client.get("/api/function/inventory", headers={"X-Forwarded-For": "10.0.0.1"})
+    other = client.get("/api/function/inventory", headers={"X-Forwarded-For": "10.0.0.2"})
+    assert (first.status_code, again.status_code, other.status_code) == (200, 429, 200)
+    assert int(again.headers["Retry-After"]) >= 1
+
+
+def test_endpoints_have_separate_buckets(make_app):
+    client = make_app(RATE_LIMIT_RATE=0.01, RATE_LIMIT_CAPACITY=2).test_client()
+    for i in range(3):
+        client.get("/api/function/summary")
+    assert client.get("/api/function/summary").status_code == 429
+    assert client.get("/api/function/transfers").status_code == 200
+    assert client.post("/api/function/transfers", json={"days": 20}).status_code == 200
+
+
+def test_rate_must_be_positive(make_app):
+    with pytest.raises(ValueError):
+        make_app(RATE_LIMIT_RATE=0)
+
+
+def test_least_recently_used_buckets_are_evicted():
+    limiter = TokenBucketLimiter(rate=0.01, capacity=1, max_clients=3)
+    for client in ["a", "b", "c", "d"]:
+        assert limiter.acquire(client) == (True, 0.0)
+    assert limiter.stats()["clients"] == 3 and limiter.stats()["evicted"] == 1
+
+    #"b" is still limited, "a" was evicted and starts over with a full bucket
+    assert limiter.acquire("b")[0] is False
+    assert limiter.acquire("a")[0] is True
+
+
+#------------------------------single flight------------------------------#
+
+#starts `count` threads calling flight.do(key, fn) and waits until they are all inside do()
+def start_callers(flight, count, key, fn):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    while sum(flight.stats()[name] for name in ["executed", "coalesced"]) < count:
+        time.sleep(0.001)
+    return threads, results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return {"units": 3}
+
+    threads, results, errors = start_callers(flight, 8, ("summary", None), slow)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1 and errors == []
+    assert len(results) == 8 and all(result is results[0] for result in results)
+    assert flight.stats() == {"executed": 1, "coalesced": 7, "errors": 0, "in_flight": 0}
+
+
+def test_leader_error_reaches_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError("database unavailable")
+
+    threads, results, errors = start_callers(flight, 5, "inventory", failing)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [] and len(errors) == 5
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert flight.stats()["errors"] == 1
+
+    #the failed call is not cached, the next one runs again
+    assert flight.do("inventory", lambda: "ok") == "ok"
+
+
+def test_different_keys_are_not_merged():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def slow(value):
+        release.wait(5)
+        return value
+
+    keys = [("transfers", None, 20), ("transfers", None, 7), ("transfers", "north", 20)]
+    results = {}
+    threads = [
+        threading.Thread(target=lambda key=key: results.__setitem__(key, flight.do(key, slow, key)))
+        for key in keys
+    ]
+    for thread in threads:
+        thread.start()
+    while flight.stats()["executed"] < len(keys):
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == {key: key for key in keys}
+    assert flight.stats()["coalesced"] == 0
@@ -0,0 +1,37 @@
+from datetime import date
+
+from database import db
+from models import BloodUnitInfoModel, DonorModel, RequestModel
+
+
+def test_transfer_moves_the_request_onto_the_expiring_unit(app, client):
+    with app.app_context():
+        donor = DonorModel(first_name="a", last_name="b", blood_type="O+", phone_num="1")
+        db.session.add(donor)
+        db.session.flush()
+        held = BloodUnitInfoModel(donor_id=donor.donor_id, donation_date=date(2025, 11, 1),
+                                  expiry_date=date(2026, 1, 10), unit_status="Reserved")
+        expiring = BloodUnitInfoModel(donor_id=donor.donor_id, donation_date=date(2025, 10, 1),
+                                      expiry_date=date(2025, 12, 4), unit_status="Available")
+        db.session.add_all([held, expiring])
+        db.session.flush()
+        req = RequestModel(hospital_id=1, unit_id=held.unit_id, request_date=date(2025, 11, 20),
+                           req_status="Processing")
+        db.session.add(req)
+        db.session.commit()
+        request_id, held_id, expiring_id = req.request_id, held.unit_id, expiring.unit_id
+
+    response = client.post("/api/function/transfers?days=20")
+    assert response.status_code == 200
+    assert response.json["proposed"] == 1
+    assert [r["request_id"] for r in response.json["updated"]] == [request_id]
+
+    with app.app_context():
+        req = db.session.get(RequestModel, request_id)
+        assert RequestModel.query.count() == 1
+        assert (req.unit_id, req.req_status, req.request_date) == (expiring_id, "Processing", date(2025, 11, 20))
+        assert db.session.get(BloodUnitInfoModel, expiring_id).unit_status == "Reserved"
+        assert db.session.get(BloodUnitInfoModel, held_id).unit_status == "Available"
+
+    #nothing left to swap
+    assert client.post("/api/function/transfers?days=20").json == {"proposed": 0, "updated": []}
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request
+
+#----------------------------------single flight-----------------------------------#
+#identical calls that arrive while one is already running wait for it and share
+#its result instead of running the same queries again
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counters = {"executed": 0, "coalesced": 0, "errors": 0}
+
+    #runs fn once per key at a time, concurrent callers with the same key get the same result
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._counters["executed"] += 1
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self._counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+
+#----------------------------------rate limiting-----------------------------------#
+#token bucket per key: holds up to `capacity` tokens and refills at `rate` tokens/sec.
+#buckets are kept in least recently used order, past max_clients the oldest ones are dropped
+#(a dropped client starts again with a full bucket)
+
+class TokenBucketLimiter:
+    def __init__(self, rate=5.0, capacity=10, max_clients=10000):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._counters = {"allowed": 0, "limited": 0, "evicted": 0}
+
+    #takes a token for the key, returns (allowed, seconds until next token)
+    #rate and capacity default to the limiter's own
+    def acquire(self, key, rate=None, capacity=None):
+        rate = self.rate if rate is None else float(rate)
+        capacity = self.capacity if capacity is None else float(capacity)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                self._counters["allowed"] += 1
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                self._counters["limited"] += 1
+                allowed, retry_after = False, (1 - tokens) / rate
+
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+                self._counters["evicted"] += 1
+        return allowed, retry_after
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["clients"] = len(self._buckets)
+        return stats
+
+
+#shared instances used by the /api/function endpoints
+single_flight = SingleFlight()
+limiter = TokenBucketLimiter()
+
+
+#resource method decorator, answers 429 when the caller is out of tokens.
+#every endpoint and method has its own bucket per client, so polling the dashboard
+#doesn't use up the tokens of a write. the client is request.remote_addr, which only
+#reflects X-Forwarded-For when the app runs behind a trusted proxy (TRUSTED_PROXIES)
+def rate_limited(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        key = (request.remote_addr or "unknown", request.endpoint, request.method)
+        allowed, retry_after = limiter.acquire(
+            key,
+            rate=current_app.config["RATE_LIMIT_RATE"],
+            capacity=current_app.config["RATE_LIMIT_CAPACITY"]
+        )
+        if not allowed:
+            seconds = max(1, int(retry_after + 0.999))
+            return {"message": "Too many requests, try again later", "retry_after": seconds}, 429, {"Retry-After": str(seconds)}
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def get_throttle_stats():
+    return {
+        "single_flight": single_flight.stats(),
+        "rate_limit": limiter.stats()
+    }
@@ -0,0 +1,74 @@
+from collections import deque
+
+#----------------------------------transfer planning-----------------------------------#
+#matches units that are about to expire with open hospital requests so the expiring unit
+#is issued in place of the unit the request currently holds (which then stays in stock longer)
+
+#red cell compatibility: recipient blood type -> donor blood types it can receive
+COMPATIBLE_DONORS = {
+    "O-": ["O-"],
+    "O+": ["O+", "O-"],
+    "A-": ["A-", "O-"],
+    "A+": ["A+", "A-", "O+", "O-"],
+    "B-": ["B-", "O-"],
+    "B+": ["B+", "B-", "O+", "O-"],
+    "AB-": ["AB-", "A-", "B-", "O-"],
+    "AB+": ["AB+", "AB-", "A+", "A-", "B+", "B-", "O+", "O-"]
+}
+
+#donor blood type -> recipient types in the order they should be served:
+#exact match first, then the recipients with the fewest compatible donors (hardest to serve)
+RECIPIENT_PREFERENCE = {
+    donor: sorted(
+        [recipient for recipient, donors in COMPATIBLE_DONORS.items() if donor in donors],
+        key=lambda recipient: (recipient != donor, len(COMPATIBLE_DONORS[recipient]))
+    )
+    for donor in COMPATIBLE_DONORS
+}
+
+
+#greedy assignment with priority: units are placed soonest expiry first, each one goes to the
+#oldest open request of the most preferred compatible type whose current unit expires later.
+#units: dicts with unit_id, blood_type, expiry_date
+#requests: dicts with request_id, hospital_id, unit_id, blood_type, expiry_date (of its unit), request_date
+#runs in O(units * 8 + requests) after sorting
+def plan_transfers(units, requests):
+    expiring_ids = {unit["unit_id"] for unit in units}
+
+    #open requests per needed blood type, oldest first
+    queues = {blood_type: [] for blood_type in COMPATIBLE_DONORS}
+    for req in sorted(requests, key=lambda r: (r["request_date"] or "", r["request_id"])):
+        if req["blood_type"] in queues and req["unit_id"] not in expiring_ids:
+            queues[req["blood_type"]].append(req)
+    queues = {blood_type: deque(reqs) for blood_type, reqs in queues.items()}
+
+    transfers = []
+    for unit in sorted(units, key=lambda u: (u["expiry_date"], u["unit_id"])):
+        for recipient in RECIPIENT_PREFERENCE.get(unit["blood_type"], []):
+            req = _take_request(queues[recipient], unit["expiry_date"])
+            if req is None:
+                continue
+            transfers.append({
+                "unit_id": unit["unit_id"],
+                "blood_type": unit["blood_type"],
+                "expiry_date": unit["expiry_date"],
+                "hospital_id": req["hospital_id"],
+                "request_id": req["request_id"],
+                "needed_type": recipient,
+                "replaces_unit_id": req["unit_id"],
+                "exact_match": recipient == unit["blood_type"]
+            })
+            break
+
+    return transfers
+
+
+#pops the oldest request that gains from the swap (its unit expires after the new one).
+#units arrive in expiry order, so a request skipped here can't gain from any later unit either
+#and is dropped, which keeps every request visited at most once
+def _take_request(queue, expiry_date):
+    while queue:
+        req = queue.popleft()
+        if req["expiry_date"] is None or req["expiry_date"] > expiry_date:
+            return req
+    return None